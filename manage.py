@@ -3,7 +3,9 @@ import os
 import sys
 
 if __name__ == "__main__":
-    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "wg_chess.settings")
+    from wg_chess import get_settings_module
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", get_settings_module())
 
     from django.core.management import execute_from_command_line
 
@@ -1,34 +1,242 @@
 # -*- coding: utf-8 -*-
 from django.contrib import admin
-from swiss.models import Matchup, Player, Round, TournamentRank, Tournament, RoundGroup, Lot
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList, SEARCH_VAR
+from django.core.paginator import InvalidPage, Paginator
+from django.db import connections
+from django.db.models import Max
+
+from swiss.models import Matchup, Player, Round, TournamentRank, Tournament, RoundGroup, Lot, TournamentArchive, Section, Bye
+from swiss.models import PlayerStats, PlayerHistory, HeadToHead
+
+# below this many rows the database statistics are too rough, COUNT(*) is cheap anyway
+EXACT_COUNT_LIMIT = 10000
+
+RECENT_TOURNAMENTS = 20
+
+
+def estimate_count(queryset):
+    '''
+    row count of the whole table from database statistics, None where the backend has none
+    '''
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+    cursor = connection.cursor()
+
+    if connection.vendor == 'mysql':
+        cursor.execute(
+            'SELECT TABLE_ROWS FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s',
+            [table]
+        )
+    elif connection.vendor == 'postgresql':
+        cursor.execute('SELECT reltuples FROM pg_class WHERE relname = %s', [table])
+    else:
+        return None
 
+    row = cursor.fetchone()
+    return int(row[0]) if row and row[0] is not None else None
 
-class MatchupAdmin(admin.ModelAdmin):
-    pass
 
+def get_count(queryset):
+    '''
+    unfiltered querysets of big tables are counted from statistics, everything else exactly
+    '''
+    if not queryset.query.where:
+        count = estimate_count(queryset)
+        if count is not None and count > EXACT_COUNT_LIMIT:
+            return count
+    return queryset.count()
 
-class PlayerAdmin(admin.ModelAdmin):
-    pass
 
+class EstimatedCountPaginator(Paginator):
 
-class RoundAdmin(admin.ModelAdmin):
-    pass
+    def _get_count(self):
+        if self._count is None:
+            self._count = get_count(self.object_list)
+        return self._count
+    count = property(_get_count)
 
 
-class RoundGroupAdmin(admin.ModelAdmin):
-    pass
+class EstimatedCountChangeList(ChangeList):
 
+    def get_results(self, request):
+        paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+        result_count = paginator.count
 
-class TournamentRankAdmin(admin.ModelAdmin):
-    pass
+        if self.get_filters_params() or self.params.get(SEARCH_VAR):
+            full_result_count = get_count(self.root_queryset)
+        else:
+            full_result_count = result_count
+        can_show_all = result_count <= self.list_max_show_all
+        multi_page = result_count > self.list_per_page
 
+        if (self.show_all and can_show_all) or not multi_page:
+            result_list = self.queryset._clone()
+        else:
+            try:
+                result_list = paginator.page(self.page_num+1).object_list
+            except InvalidPage:
+                raise IncorrectLookupParameters
 
-class TournamentAdmin(admin.ModelAdmin):
-    pass
+        self.result_count = result_count
+        self.full_result_count = full_result_count
+        self.result_list = result_list
+        self.can_show_all = can_show_all
+        self.multi_page = multi_page
+        self.paginator = paginator
 
 
-class LotAdmin(admin.ModelAdmin):
-    pass
+class EstimatedCountAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+
+    def get_changelist(self, request, **kwargs):
+        return EstimatedCountChangeList
+
+
+class TournamentListFilter(admin.SimpleListFilter):
+    '''
+    offers only the latest tournaments, any other one is reachable by ?tournament=<id>
+    '''
+    title = 'tournament'
+    parameter_name = 'tournament'
+    tournament_field = 'tournament'
+
+    def lookups(self, request, model_admin):
+        tournaments = Tournament.objects.order_by('-id')[:RECENT_TOURNAMENTS]
+        return [(str(tournament.id), unicode(tournament)) for tournament in tournaments]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(**{self.tournament_field: self.value()})
+        return queryset
+
+
+class RoundNumberListFilter(admin.SimpleListFilter):
+    title = 'round'
+    parameter_name = 'round_number'
+    round_number_field = 'number'
+
+    def lookups(self, request, model_admin):
+        number_of_rounds = Round.objects.aggregate(Max('number'))['number__max'] or 0
+        return [(str(number), 'Round #{0}'.format(number)) for number in range(1, number_of_rounds + 1)]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(**{self.round_number_field: self.value()})
+        return queryset
+
+
+class ByRoundGroupTournamentListFilter(TournamentListFilter):
+    tournament_field = 'round_group__tournament_round__tournament'
+
+
+class ByRoundGroupRoundNumberListFilter(RoundNumberListFilter):
+    round_number_field = 'round_group__tournament_round__number'
+
+
+class ByRoundTournamentListFilter(TournamentListFilter):
+    tournament_field = 'tournament_round__tournament'
+
+
+class ByRoundRoundNumberListFilter(RoundNumberListFilter):
+    round_number_field = 'tournament_round__number'
+
+
+class MatchupAdmin(EstimatedCountAdmin):
+    list_display = ('id', 'round_group', 'black', 'white', 'black_score', 'white_score')
+    list_select_related = ('round_group__tournament_round', 'black__player', 'white__player')
+    list_filter = (ByRoundGroupTournamentListFilter, ByRoundGroupRoundNumberListFilter)
+    raw_id_fields = ('round_group', 'black', 'white')
+
+
+class PlayerAdmin(EstimatedCountAdmin):
+    list_display = ('name', 'elo')
+    search_fields = ('name', )
+
+
+class RoundAdmin(EstimatedCountAdmin):
+    list_display = ('__unicode__', 'tournament', 'nonplayer')
+    list_select_related = ('tournament', 'nonplayer')
+    list_filter = (TournamentListFilter, RoundNumberListFilter)
+    raw_id_fields = ('tournament', 'nonplayer')
+
+
+class RoundGroupAdmin(EstimatedCountAdmin):
+    list_display = ('__unicode__', 'section', 'score_value')
+    list_select_related = ('tournament_round', 'section')
+    list_filter = (ByRoundTournamentListFilter, ByRoundRoundNumberListFilter)
+    raw_id_fields = ('tournament_round', 'section')
+
+
+class TournamentRankAdmin(EstimatedCountAdmin):
+    list_display = ('player', 'tournament', 'section', 'rank', 'score', 'buchholz_factor', 'starting_elo', 'final_elo')
+    list_select_related = ('player', 'tournament', 'section')
+    list_filter = (TournamentListFilter, )
+    raw_id_fields = ('player', 'tournament', 'section')
+
+
+class TournamentAdmin(EstimatedCountAdmin):
+    list_display = ('__unicode__', 'number_of_winners', 'number_of_rounds', 'is_finished')
+    list_filter = ('is_finished', )
+    actions = ('recompute_scores', 'archive_tournaments')
+
+    def recompute_scores(self, request, queryset):
+        count = Tournament.recompute_scores(queryset)
+        self.message_user(request, 'Scores and Buchholz factors recomputed for {0} players'.format(count))
+    recompute_scores.short_description = 'Recompute scores and tie-breaks for selected tournaments'
+
+    def archive_tournaments(self, request, queryset):
+        archives = [tournament.archive() for tournament in queryset.filter(is_finished=True)]
+        self.message_user(request, '{0} tournaments archived'.format(len([archive for archive in archives if archive])))
+    archive_tournaments.short_description = 'Archive selected finished tournaments'
+
+
+class LotAdmin(EstimatedCountAdmin):
+    list_display = ('id', 'round_group', 'player', 'is_shifted')
+    list_select_related = ('round_group__tournament_round', 'player__player')
+    list_filter = (ByRoundGroupTournamentListFilter, ByRoundGroupRoundNumberListFilter)
+    raw_id_fields = ('player', 'round_group')
+
+
+class SectionAdmin(EstimatedCountAdmin):
+    list_display = ('__unicode__', 'tournament', 'min_elo', 'max_elo')
+    list_select_related = ('tournament', )
+    list_filter = (TournamentListFilter, )
+    raw_id_fields = ('tournament', )
+
+
+class ByeAdmin(EstimatedCountAdmin):
+    list_display = ('tournament_round', 'section', 'player')
+    list_select_related = ('tournament_round', 'section', 'player__player')
+    list_filter = (ByRoundTournamentListFilter, ByRoundRoundNumberListFilter)
+    raw_id_fields = ('tournament_round', 'section', 'player')
+
+
+class PlayerStatsAdmin(EstimatedCountAdmin):
+    list_display = ('player', 'tournaments_played', 'games', 'wins', 'draws', 'losses', 'score')
+    list_select_related = ('player', )
+    raw_id_fields = ('player', )
+    search_fields = ('player__name', )
+
+
+class PlayerHistoryAdmin(EstimatedCountAdmin):
+    list_display = ('player', 'tournament', 'place', 'final_score', 'starting_elo', 'final_elo')
+    list_select_related = ('player', 'tournament')
+    list_filter = (TournamentListFilter, )
+    raw_id_fields = ('player', 'tournament')
+
+
+class HeadToHeadAdmin(EstimatedCountAdmin):
+    list_display = ('player', 'opponent', 'games', 'wins', 'draws', 'losses', 'score')
+    list_select_related = ('player', 'opponent')
+    raw_id_fields = ('player', 'opponent')
+    search_fields = ('player__name', )
+
+
+class TournamentArchiveAdmin(admin.ModelAdmin):
+    list_display = ('tournament', 'archived_at')
+    list_select_related = ('tournament', )
+    raw_id_fields = ('tournament', )
 
 
 
@@ -39,3 +247,9 @@ admin.site.register(RoundGroup, RoundGroupAdmin)
 admin.site.register(TournamentRank, TournamentRankAdmin)
 admin.site.register(Tournament, TournamentAdmin)
 admin.site.register(Lot, LotAdmin)
+admin.site.register(TournamentArchive, TournamentArchiveAdmin)
+admin.site.register(Section, SectionAdmin)
+admin.site.register(Bye, ByeAdmin)
+admin.site.register(PlayerStats, PlayerStatsAdmin)
+admin.site.register(PlayerHistory, PlayerHistoryAdmin)
+admin.site.register(HeadToHead, HeadToHeadAdmin)
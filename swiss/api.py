@@ -0,0 +1,339 @@
+import base64
+import hashlib
+import json
+
+from django.core.cache import cache
+from django.db.models import Q
+from django.http import HttpResponse, HttpResponseBadRequest
+from django.shortcuts import get_object_or_404
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import require_GET
+
+from swiss.models import HeadToHead, Player, Round, Tournament
+from swiss.models import get_tournament_cache_version
+
+API_CACHE_TIMEOUT = 60 * 10
+
+OPPONENTS_PAGE_SIZE = 50
+STANDINGS_PAGE_SIZE = 50
+STANDINGS_MAX_PAGE_SIZE = 500
+
+TOURNAMENT_FIELDS = (
+    ('id', lambda tournament: tournament.id),
+    ('number_of_winners', lambda tournament: tournament.number_of_winners),
+    ('number_of_rounds', lambda tournament: tournament.number_of_rounds),
+    ('is_finished', lambda tournament: tournament.is_finished),
+)
+
+SECTION_FIELDS = (
+    ('id', lambda section: section.id),
+    ('number', lambda section: section.number),
+    ('min_elo', lambda section: section.min_elo),
+    ('max_elo', lambda section: section.max_elo),
+)
+
+ROUND_FIELDS = (
+    ('id', lambda tournament_round: tournament_round.id),
+    ('number', lambda tournament_round: tournament_round.number),
+    ('nonplayer', lambda tournament_round: tournament_round.nonplayer_id),
+)
+
+STANDING_FIELDS = (
+    ('position', lambda ranked_player: ranked_player.position),
+    ('id', lambda ranked_player: ranked_player.id),
+    ('rank', lambda ranked_player: ranked_player.rank),
+    ('player', lambda ranked_player: ranked_player.player_id),
+    ('section', lambda ranked_player: ranked_player.section_id),
+    ('name', lambda ranked_player: ranked_player.player.name),
+    ('starting_elo', lambda ranked_player: ranked_player.starting_elo),
+    ('final_elo', lambda ranked_player: ranked_player.final_elo),
+    ('score', lambda ranked_player: ranked_player.score),
+    ('buchholz_factor', lambda ranked_player: ranked_player.buchholz_factor),
+)
+
+MATCHUP_FIELDS = (
+    ('id', lambda matchup: matchup.id),
+    ('group', lambda matchup: matchup.round_group.score_value),
+    ('section', lambda matchup: matchup.round_group.section_id),
+    ('black', lambda matchup: matchup.black_id),
+    ('black_name', lambda matchup: matchup.black.player.name),
+    ('white', lambda matchup: matchup.white_id),
+    ('white_name', lambda matchup: matchup.white.player.name),
+    ('black_score', lambda matchup: matchup.black_score),
+    ('white_score', lambda matchup: matchup.white_score),
+    ('result', lambda matchup: matchup.get_winner()),
+)
+
+BYE_FIELDS = (
+    ('section', lambda bye: bye.section_id),
+    ('player', lambda bye: bye.player_id),
+    ('name', lambda bye: bye.player.player.name),
+)
+
+PLAYER_HISTORY_FIELDS = (
+    ('tournament', lambda history: history.tournament_id),
+    ('place', lambda history: history.place),
+    ('final_score', lambda history: history.final_score),
+    ('buchholz_factor', lambda history: history.buchholz_factor),
+    ('starting_elo', lambda history: history.starting_elo),
+    ('final_elo', lambda history: history.final_elo),
+    ('elo_change', lambda history: history.get_elo_change()),
+    ('games', lambda history: history.games),
+    ('wins', lambda history: history.wins),
+    ('draws', lambda history: history.draws),
+    ('losses', lambda history: history.losses),
+    ('performance_rating', lambda history: history.get_performance_rating()),
+)
+
+STATISTICS_FIELDS = (
+    ('tournaments_played', lambda statistics: statistics.tournaments_played),
+    ('games', lambda statistics: statistics.games),
+    ('wins', lambda statistics: statistics.wins),
+    ('draws', lambda statistics: statistics.draws),
+    ('losses', lambda statistics: statistics.losses),
+    ('score', lambda statistics: statistics.score),
+    ('performance_rating', lambda statistics: statistics.get_performance_rating()),
+)
+
+HEAD_TO_HEAD_FIELDS = (
+    ('opponent', lambda head_to_head: head_to_head.opponent_id),
+    ('opponent_name', lambda head_to_head: head_to_head.opponent.name),
+    ('games', lambda head_to_head: head_to_head.games),
+    ('wins', lambda head_to_head: head_to_head.wins),
+    ('draws', lambda head_to_head: head_to_head.draws),
+    ('losses', lambda head_to_head: head_to_head.losses),
+    ('score', lambda head_to_head: head_to_head.score),
+)
+
+
+class ApiError(Exception):
+    pass
+
+
+def get_fields(request, available_fields):
+    '''
+    picks the fields listed in ?fields=a,b,c (all of them by default), keeping the requested order
+    '''
+    fields = request.GET.get('fields')
+    if not fields:
+        return available_fields
+
+    accessors = dict(available_fields)
+    selected_fields = []
+    for name in fields.split(','):
+        if name not in accessors:
+            raise ApiError('unknown field: {0}'.format(name))
+        selected_fields.append((name, accessors[name]))
+    return selected_fields
+
+
+def is_compact(request):
+    return request.GET.get('format') == 'compact'
+
+
+def serialize(objects, fields, compact):
+    '''
+    compact payload is {"fields": [...], "rows": [[...], ...]} -- field names are sent only once
+    '''
+    if compact:
+        return {
+            'fields': [name for name, accessor in fields],
+            'rows': [[accessor(obj) for name, accessor in fields] for obj in objects],
+        }
+    return [dict((name, accessor(obj)) for name, accessor in fields) for obj in objects]
+
+
+def serialize_one(obj, fields):
+    return dict((name, accessor(obj)) for name, accessor in fields)
+
+
+def json_response(payload):
+    return HttpResponse(json.dumps(payload, separators=(',', ':')), content_type='application/json')
+
+
+def cached_json_response(request, tournament_id, build_payload):
+    '''
+    responses are cached under the tournament cache version, the same one the html pages use,
+    so any result or new round drops them together with the rendered fragments
+    '''
+    key = 'swiss:api:{0}:{1}:{2}'.format(
+        tournament_id,
+        get_tournament_cache_version(tournament_id),
+        hashlib.md5(request.get_full_path()).hexdigest(),
+    )
+    body = cache.get(key)
+    if body is None:
+        body = json.dumps(build_payload(), separators=(',', ':'))
+        cache.set(key, body, API_CACHE_TIMEOUT)
+    return HttpResponse(body, content_type='application/json')
+
+
+def encode_cursor(ranked_player):
+    values = [ranked_player.score, ranked_player.buchholz_factor, ranked_player.rank, ranked_player.position]
+    return base64.urlsafe_b64encode(json.dumps(values))
+
+
+def decode_cursor(cursor):
+    try:
+        score, buchholz_factor, rank, position = json.loads(base64.urlsafe_b64decode(str(cursor)))
+        return float(score), float(buchholz_factor), int(rank), int(position)
+    except (TypeError, ValueError):
+        raise ApiError('invalid cursor')
+
+
+def get_section(request):
+    section = request.GET.get('section')
+    if not section:
+        return None
+    try:
+        return int(section)
+    except ValueError:
+        raise ApiError('invalid section')
+
+
+def get_limit(request, default=STANDINGS_PAGE_SIZE):
+    try:
+        limit = int(request.GET.get('limit', default))
+    except ValueError:
+        raise ApiError('invalid limit')
+    if limit < 1:
+        raise ApiError('invalid limit')
+    return min(limit, STANDINGS_MAX_PAGE_SIZE)
+
+
+def api_view(view):
+    '''
+    read-only, gzipped, and ApiError turns into 400
+    '''
+    @gzip_page
+    @require_GET
+    def wrapper(request, *args, **kwargs):
+        try:
+            return view(request, *args, **kwargs)
+        except ApiError as error:
+            return HttpResponseBadRequest(json.dumps({'error': str(error)}), content_type='application/json')
+    wrapper.__name__ = view.__name__
+    wrapper.__doc__ = view.__doc__
+    return wrapper
+
+
+@api_view
+def tournament_list(request):
+    fields = get_fields(request, TOURNAMENT_FIELDS)
+    tournaments = Tournament.objects.order_by('-id')
+    return json_response(serialize(tournaments, fields, is_compact(request)))
+
+
+@api_view
+def tournament_detail(request, pk):
+    fields = get_fields(request, TOURNAMENT_FIELDS)
+    compact = is_compact(request)
+
+    def build_payload():
+        tournament = get_object_or_404(Tournament, pk=pk)
+        payload = serialize_one(tournament, fields)
+        payload['sections'] = serialize(tournament.section_set.order_by('number'), SECTION_FIELDS, compact)
+        payload['rounds'] = serialize(tournament.round_set.order_by('number'), ROUND_FIELDS, compact)
+        return payload
+
+    return cached_json_response(request, pk, build_payload)
+
+
+@api_view
+def tournament_standings(request, pk):
+    '''
+    standings ordered as on the tournament page, paginated with ?cursor=...&limit=N;
+    ?section=<id> gives the standings of one section
+    '''
+    fields = get_fields(request, STANDING_FIELDS)
+    limit = get_limit(request)
+    section = get_section(request)
+    cursor = request.GET.get('cursor')
+    if cursor:
+        score, buchholz_factor, rank, position = decode_cursor(cursor)
+    else:
+        position = 0
+
+    def build_payload():
+        tournament = get_object_or_404(Tournament, pk=pk)
+        ranked_players = tournament.get_ranked_players()
+        if section:
+            ranked_players = ranked_players.filter(section=section)
+        if cursor:
+            ranked_players = ranked_players.filter(
+                Q(score__lt=score) |
+                Q(score=score, buchholz_factor__lt=buchholz_factor) |
+                Q(score=score, buchholz_factor=buchholz_factor, rank__gt=rank)
+            )
+        ranked_players = list(ranked_players[:limit + 1])
+
+        for number, ranked_player in enumerate(ranked_players):
+            ranked_player.position = position + number + 1
+
+        next_cursor = None
+        if len(ranked_players) > limit:
+            ranked_players = ranked_players[:limit]
+            next_cursor = encode_cursor(ranked_players[-1])
+
+        return {
+            'standings': serialize(ranked_players, fields, is_compact(request)),
+            'next_cursor': next_cursor,
+        }
+
+    return cached_json_response(request, pk, build_payload)
+
+
+@api_view
+def round_detail(request, pk):
+    fields = get_fields(request, MATCHUP_FIELDS)
+    tournament_round = get_object_or_404(Round, pk=pk)
+
+    def build_payload():
+        payload = serialize_one(tournament_round, ROUND_FIELDS)
+        payload['tournament'] = tournament_round.tournament_id
+        payload['matchups'] = serialize(tournament_round.get_matchups(), fields, is_compact(request))
+        payload['byes'] = serialize(tournament_round.get_byes(), BYE_FIELDS, is_compact(request))
+        return payload
+
+    return cached_json_response(request, tournament_round.tournament_id, build_payload)
+
+
+@api_view
+def player_detail(request, pk):
+    fields = get_fields(request, PLAYER_HISTORY_FIELDS)
+    player = get_object_or_404(Player, pk=pk)
+    history = player.get_history()
+
+    statistics = player.get_statistics()
+
+    payload = {
+        'id': player.id,
+        'name': player.name,
+        'elo': player.elo,
+        'statistics': serialize_one(statistics, STATISTICS_FIELDS) if statistics else None,
+        'history': serialize(history, fields, is_compact(request)),
+    }
+    return json_response(payload)
+
+
+@api_view
+def player_opponents(request, pk):
+    '''
+    head-to-head against every opponent, the most frequent ones first
+    '''
+    fields = get_fields(request, HEAD_TO_HEAD_FIELDS)
+    limit = get_limit(request, OPPONENTS_PAGE_SIZE)
+    player = get_object_or_404(Player, pk=pk)
+    return json_response(serialize(player.get_opponents()[:limit], fields, is_compact(request)))
+
+
+@api_view
+def head_to_head(request, pk, opponent_pk):
+    fields = get_fields(request, HEAD_TO_HEAD_FIELDS)
+    player = get_object_or_404(Player, pk=pk)
+    opponent = get_object_or_404(Player, pk=opponent_pk)
+    try:
+        games = HeadToHead.objects.select_related('opponent').get(player=player, opponent=opponent)
+    except HeadToHead.DoesNotExist:
+        games = HeadToHead(player=player, opponent=opponent)
+    return json_response(serialize_one(games, fields))
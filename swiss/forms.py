@@ -7,11 +7,25 @@ class TournamentAddForm(forms.ModelForm):
 
     ranked_players = forms.ModelMultipleChoiceField(queryset=Player.objects.all())
     # ranked_players = forms.ModelMultipleChoiceField(widget=forms.CheckboxSelectMultiple, queryset=Player.objects.all())
+    rating_bands = forms.CharField(required=False)
 
     class Meta:
         model = Tournament
         exclude = ('number_of_rounds', )
 
+    def clean_rating_bands(self):
+        '''
+        lowest Elo of every section but the bottom one, separated with commas
+        '''
+        try:
+            return [float(min_elo) for min_elo in self.cleaned_data['rating_bands'].replace(',', ' ').split()]
+        except ValueError:
+            raise forms.ValidationError('Enter Elo ratings separated with commas')
+
     def save(self, commit=True):
-        tournament = Tournament.start_tournament(self.cleaned_data['ranked_players'], self.cleaned_data['number_of_winners'])
+        tournament = Tournament.start_tournament(
+            self.cleaned_data['ranked_players'],
+            self.cleaned_data['number_of_winners'],
+            self.cleaned_data['rating_bands'],
+        )
         return tournament
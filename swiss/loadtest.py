@@ -0,0 +1,302 @@
+'''
+load test: many judges run many tournaments at once while spectators poll the pages.
+Requests go either straight to the WSGI application in this process or to a running server
+'''
+import httplib
+import json
+import math
+import random
+import threading
+import time
+import urllib
+import urlparse
+from Cookie import SimpleCookie
+from multiprocessing.pool import ThreadPool
+from StringIO import StringIO
+from wsgiref.util import setup_testing_defaults
+
+from django.contrib.auth.models import User
+
+from fixt import createplayers
+from swiss.models import Matchup, Player, Round, Tournament, TournamentRank, RESULT_SCORES
+
+# judge gives up on a tournament after polling it this many times
+MAX_POLLS = 200
+
+PERCENTILES = (50, 95, 99)
+
+
+class WsgiTransport(object):
+    '''
+    calls the WSGI application in process, no sockets involved
+    '''
+
+    def __init__(self, application):
+        self.application = application
+
+    def request(self, method, path, body='', headers=None):
+        path, _, query = path.partition('?')
+        environ = {}
+        setup_testing_defaults(environ)
+        environ.update({
+            'REQUEST_METHOD': method,
+            'PATH_INFO': path,
+            'QUERY_STRING': query,
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.input': StringIO(body),
+        })
+        if body:
+            environ['CONTENT_TYPE'] = 'application/x-www-form-urlencoded'
+        for name, value in (headers or {}).items():
+            environ['HTTP_' + name.upper().replace('-', '_')] = value
+
+        response = {}
+
+        def start_response(status, response_headers, exc_info=None):
+            response['status'] = int(status.split()[0])
+            response['headers'] = response_headers
+
+        result = self.application(environ, start_response)
+        try:
+            content = ''.join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return response['status'], response['headers'], content
+
+
+class HttpTransport(object):
+
+    def __init__(self, url):
+        parsed_url = urlparse.urlparse(url)
+        self.host = parsed_url.hostname
+        self.port = parsed_url.port or 80
+
+    def request(self, method, path, body='', headers=None):
+        headers = dict(headers or {})
+        if body:
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        connection = httplib.HTTPConnection(self.host, self.port)
+        try:
+            connection.request(method, path, body or None, headers)
+            response = connection.getresponse()
+            content = response.read()
+            return response.status, response.getheaders(), content
+        finally:
+            connection.close()
+
+
+class Stats(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+
+    def add(self, endpoint, latency, is_error):
+        with self.lock:
+            self.latencies.setdefault(endpoint, []).append(latency)
+            if is_error:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    def get_requests_count(self):
+        return sum(len(latencies) for latencies in self.latencies.values())
+
+
+def get_percentile(sorted_values, percentile):
+    '''
+    nearest rank: the smallest value with at least percentile % of the values at or below it
+    '''
+    index = int(math.ceil(percentile / 100. * len(sorted_values))) - 1
+    return sorted_values[max(0, min(index, len(sorted_values) - 1))]
+
+
+class Client(object):
+    '''
+    one judge or spectator: keeps its own cookies and times every request
+    '''
+
+    def __init__(self, transport, stats):
+        self.transport = transport
+        self.stats = stats
+        self.cookies = {}
+
+    def request(self, endpoint, method, path, data=None, headers=None):
+        headers = dict(headers or {})
+        if self.cookies:
+            headers['Cookie'] = '; '.join('{0}={1}'.format(name, value) for name, value in self.cookies.items())
+        body = urllib.urlencode(data) if data else ''
+
+        starts_at = time.time()
+        try:
+            status, response_headers, content = self.transport.request(method, path, body, headers)
+        except Exception:
+            self.stats.add(endpoint, time.time() - starts_at, True)
+            raise
+        self.stats.add(endpoint, time.time() - starts_at, status >= 400)
+
+        for name, value in response_headers:
+            if name.lower() == 'set-cookie':
+                for morsel in SimpleCookie(value).values():
+                    self.cookies[morsel.key] = morsel.value
+        return status, content
+
+    def get(self, endpoint, path, headers=None):
+        return self.request(endpoint, 'GET', path, headers=headers)
+
+    def get_json(self, endpoint, path):
+        status, content = self.get(endpoint, path)
+        return json.loads(content) if status == 200 else None
+
+    def login(self, username, password):
+        self.get('login', '/accounts/login/')
+        self.request('login', 'POST', '/accounts/login/', {
+            'username': username,
+            'password': password,
+            'csrfmiddlewaretoken': self.cookies.get('csrftoken', ''),
+        })
+
+
+class LoadTest(object):
+
+    def __init__(self, transport, tournaments=10, players=32, judges=4, spectators=10, password='loadtest'):
+        self.transport = transport
+        self.tournaments_count = tournaments
+        self.players_count = players
+        self.judges_count = judges
+        self.spectators_count = spectators
+        self.password = password
+
+        self.stats = Stats()
+        self.judges_done = threading.Event()
+        self.stalled_tournaments = []
+
+    def prepare(self):
+        '''
+        judge account and tournaments are created directly in the database, like fixt does
+        '''
+        username = 'loadtest'
+        if not User.objects.filter(username=username).exists():
+            User.objects.create_user(username, password=self.password)
+        self.username = username
+
+        player_ids = list(Player.objects.values_list('id', flat=True))
+        if len(player_ids) < self.players_count:
+            createplayers(self.players_count - len(player_ids))
+            player_ids = list(Player.objects.values_list('id', flat=True))
+
+        self.tournament_ids = []
+        for number in range(self.tournaments_count):
+            players = Player.objects.filter(id__in=random.sample(player_ids, self.players_count))
+            self.tournament_ids.append(Tournament.start_tournament(players, 1).id)
+
+    def judge(self, number, tournament_id):
+        '''
+        plays the tournament through: records results in random order, starts rounds and calculates Elo.
+        Every judge of the tournament does the same, so they race for the same matchups
+        '''
+        client = Client(self.transport, self.stats)
+        client.login(self.username, self.password)
+
+        for poll in range(MAX_POLLS):
+            tournament = client.get_json('api_tournament', '/swiss/api/tournament/{0}/'.format(tournament_id))
+            if tournament is None:
+                continue
+            if tournament['is_finished']:
+                return
+
+            current_round = tournament['rounds'][-1]
+            tournament_round = client.get_json('api_round', '/swiss/api/round/{0}/?fields=id,result'.format(current_round['id']))
+            unplayed = [matchup['id'] for matchup in tournament_round['matchups'] if matchup['result'] == 'Not played yet']
+
+            if unplayed:
+                random.shuffle(unplayed)
+                for matchup_id in unplayed:
+                    result = random.choice(RESULT_SCORES.keys())
+                    client.get('set_result', '/swiss/matchup/{0}/{1}/'.format(matchup_id, result), {
+                        'X-Idempotency-Key': 'loadtest-{0}-{1}'.format(number, matchup_id),
+                    })
+            elif current_round['number'] < tournament['number_of_rounds']:
+                client.get('start_next_round', '/swiss/start_next_round/{0}/'.format(tournament_id))
+            else:
+                client.get('final_calcs', '/swiss/final_calcs/{0}/'.format(tournament_id))
+
+        self.stalled_tournaments.append(tournament_id)
+
+    def spectator(self):
+        client = Client(self.transport, self.stats)
+        while not self.judges_done.is_set():
+            tournament_id = random.choice(self.tournament_ids)
+            client.get('tournament_page', '/swiss/tournament/{0}/'.format(tournament_id))
+            tournament = client.get_json('api_tournament', '/swiss/api/tournament/{0}/'.format(tournament_id))
+            if tournament and tournament['rounds']:
+                client.get('round_page', '/swiss/round/{0}/'.format(tournament['rounds'][-1]['id']))
+            client.get('api_standings', '/swiss/api/tournament/{0}/standings/?format=compact&limit=20'.format(tournament_id))
+
+    def run(self):
+        judges = []
+        for tournament_id in self.tournament_ids:
+            for number in range(self.judges_count):
+                judges.append((number, tournament_id))
+
+        pool = ThreadPool(len(judges) + self.spectators_count)
+        starts_at = time.time()
+        try:
+            spectators = [pool.apply_async(self.spectator) for number in range(self.spectators_count)]
+            results = [pool.apply_async(self.judge, judge) for judge in judges]
+            for result in results:
+                result.get()
+            self.judges_done.set()
+            for result in spectators:
+                result.get()
+        finally:
+            self.judges_done.set()
+            pool.close()
+            pool.join()
+        self.elapsed = time.time() - starts_at
+
+    def check_consistency(self):
+        '''
+        problems found in the database after the run, each as a string
+        '''
+        problems = []
+        tournaments = Tournament.objects.filter(id__in=self.tournament_ids)
+
+        for tournament in tournaments:
+            numbers = list(Round.objects.filter(tournament=tournament).values_list('number', flat=True))
+            if sorted(numbers) != range(1, int(tournament.number_of_rounds) + 1):
+                problems.append('{0} has rounds {1}'.format(tournament, sorted(numbers)))
+            if not tournament.is_finished:
+                problems.append('{0} is not finished'.format(tournament))
+
+        unplayed = Matchup.objects.filter(round_group__tournament_round__tournament__in=tournaments, black_score=0, white_score=0)
+        if unplayed.exists():
+            problems.append('{0} matchups are not played'.format(unplayed.count()))
+
+        scores = Tournament.compute_scores(tournaments)
+        for rank_id, score in TournamentRank.objects.filter(tournament__in=tournaments).values_list('id', 'score'):
+            if scores.get(rank_id) != score:
+                problems.append('rank {0} has score {1} instead of {2}'.format(rank_id, score, scores.get(rank_id)))
+
+        for tournament_id in self.stalled_tournaments:
+            problems.append('Tournament #{0} stalled'.format(tournament_id))
+
+        return problems
+
+    def format_report(self, problems):
+        lines = [
+            '{0} requests in {1:.2f}s, {2:.1f} requests per second'.format(
+                self.stats.get_requests_count(), self.elapsed, self.stats.get_requests_count() / self.elapsed),
+            '',
+            '{0:<18}{1:>8}{2:>8}{3:>10}{4:>10}{5:>10}{6:>10}'.format('endpoint', 'count', 'errors', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms'),
+        ]
+        for endpoint in sorted(self.stats.latencies):
+            latencies = sorted(self.stats.latencies[endpoint])
+            row = [get_percentile(latencies, percentile) * 1000 for percentile in PERCENTILES] + [latencies[-1] * 1000]
+            lines.append('{0:<18}{1:>8}{2:>8}{3:>10.1f}{4:>10.1f}{5:>10.1f}{6:>10.1f}'.format(
+                endpoint, len(latencies), self.stats.errors.get(endpoint, 0), *row))
+
+        lines.append('')
+        lines.append('{0} consistency problems'.format(len(problems)))
+        lines.extend(problems)
+        return '\n'.join(lines)
@@ -0,0 +1,26 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from swiss.models import Tournament
+
+
+class Command(BaseCommand):
+    help = 'Moves pairings and results of finished tournaments into compact archive summaries'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--dry-run', action='store_true', dest='dry_run', default=False,
+            help='Only list tournaments that would be archived'),
+    )
+
+    def handle(self, *args, **options):
+        tournaments = Tournament.objects.filter(is_finished=True, tournamentarchive__isnull=True)
+        if args:
+            tournaments = tournaments.filter(id__in=args)
+
+        for tournament in tournaments:
+            if options['dry_run']:
+                self.stdout.write('{0} would be archived'.format(tournament))
+            else:
+                tournament.archive()
+                self.stdout.write('{0} archived'.format(tournament))
@@ -0,0 +1,42 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from swiss.loadtest import HttpTransport, LoadTest, WsgiTransport
+
+
+class Command(BaseCommand):
+    help = 'Runs concurrent judges and spectators against the app and reports throughput, latency and consistency'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--url', dest='url', default=None,
+            help='Base url of a running server, e.g. http://localhost:8080. By default the WSGI application runs in process'),
+        make_option('--tournaments', dest='tournaments', type='int', default=10,
+            help='Number of simultaneous tournaments'),
+        make_option('--players', dest='players', type='int', default=32,
+            help='Players in each tournament'),
+        make_option('--judges', dest='judges', type='int', default=4,
+            help='Judges racing each other in each tournament'),
+        make_option('--spectators', dest='spectators', type='int', default=10,
+            help='Spectators polling tournament and round pages'),
+    )
+
+    def handle(self, *args, **options):
+        if options['url']:
+            transport = HttpTransport(options['url'])
+        else:
+            from wg_chess.wsgi import application
+            transport = WsgiTransport(application)
+
+        load_test = LoadTest(
+            transport,
+            tournaments=options['tournaments'],
+            players=options['players'],
+            judges=options['judges'],
+            spectators=options['spectators'],
+        )
+        load_test.prepare()
+        load_test.run()
+        problems = load_test.check_consistency()
+
+        self.stdout.write(load_test.format_report(problems))
@@ -0,0 +1,11 @@
+from django.core.management.base import NoArgsCommand
+
+from swiss.models import PlayerStats
+
+
+class Command(NoArgsCommand):
+    help = 'Recalculates statistics, tournament history and head-to-head of every player from recorded games'
+
+    def handle_noargs(self, **options):
+        count = PlayerStats.rebuild()
+        self.stdout.write('Statistics rebuilt for {0} players'.format(count))
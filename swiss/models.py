@@ -1,13 +1,127 @@
+import json
 import math
+import multiprocessing
+import operator
+import random
+import zlib
 from datetime import datetime
+from functools import wraps
 
-from django.db import models
-from django.db.models import Q
+from django.core.cache import cache
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, Q
 
 SCORE_FOR_WIN = 1.0
 SCORE_FOR_DRAW = 0.5
 SCORE_FOR_NONPLAY = 0.5
 
+# black and white scores for each result a judge can record
+RESULT_SCORES = {
+    'black': (SCORE_FOR_WIN, 0.0),
+    'white': (0.0, SCORE_FOR_WIN),
+    'draw': (SCORE_FOR_DRAW, SCORE_FOR_DRAW),
+}
+
+TOURNAMENT_CACHE_VERSION_KEY = 'swiss:tournament:{0}:version'
+
+# leaves room for increments below memcached's 64 bit counters
+CACHE_VERSION_BITS = 62
+
+# fields of the rank tuples the pairing works on, see pair_section
+RANK_ID, RANK_SCORE, RANK_STARTING_ELO = range(3)
+
+# a process pool takes ~100 ms to start, about as long as pairing this many players in one process
+PARALLEL_PAIRING_MIN_PLAYERS = 20000
+
+# head-to-head pairs looked up in one query: two parameters each, under the 999 sqlite allows
+HEAD_TO_HEAD_LOOKUP_BATCH = 400
+
+
+def get_new_cache_version():
+    '''
+    a version for an evicted or never set version key. Pages cached under old versions may still be live,
+    so it is random rather than time based (bumps can run ahead of the clock), and from os.urandom
+    since forked workers share the state of the random module
+    '''
+    return random.SystemRandom().getrandbits(CACHE_VERSION_BITS)
+
+
+def get_tournament_cache_version(tournament_id):
+    '''
+    version of everything rendered for the tournament: standings, rounds and pairings.
+    pages and api responses put it in their cache keys, so bumping it drops them all at once
+    '''
+    key = TOURNAMENT_CACHE_VERSION_KEY.format(tournament_id)
+    version = cache.get(key)
+    if version is None:
+        version = get_new_cache_version()
+        cache.add(key, version, None)
+        version = cache.get(key, version)
+    return version
+
+
+def invalidate_tournament_cache(tournament_id):
+    key = TOURNAMENT_CACHE_VERSION_KEY.format(tournament_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, get_new_cache_version(), None)
+
+
+def tournament_transaction(method):
+    '''
+    runs the tournament method in a transaction and drops the tournament cache after the commit:
+    dropped inside the transaction, it lets a concurrent reader cache old data under the new version
+    '''
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with transaction.atomic():
+            result = method(self, *args, **kwargs)
+        invalidate_tournament_cache(self.pk)
+        return result
+    return wrapper
+
+
+def pair_section(ranks):
+    '''
+    pairs the next round of one section. Takes and returns plain data only, so it can run in a worker
+    process: ranks are (id, score, starting elo) tuples, the result is the score groups as
+    (score value, [(rank id, is shifted), ...], [(black id, white id), ...]) and the rank id of the bye
+    '''
+    paired_ids = set()
+    paired_groups = []
+    for group in RoundGroupProxy.get_round_groups(ranks):
+        pairs = group.get_pairs()
+        for pair in pairs:
+            paired_ids.update(pair)
+        lots = [(rank[RANK_ID], is_shifted == 'shifted') for rank, is_shifted in group.ranks]
+        paired_groups.append((group.score_value, lots, pairs))
+
+    unpaired_ids = [rank[RANK_ID] for rank in ranks if rank[RANK_ID] not in paired_ids]
+    return paired_groups, unpaired_ids[0] if unpaired_ids else None
+
+
+def pair_sections(sections, processes=1):
+    '''
+    {section id: ranks} to {section id: pairing}. Sections don't depend on each other,
+    so with several processes they are paired on a process pool at once
+    '''
+    section_ids = sorted(sections)
+    section_ranks = [sections[section_id] for section_id in section_ids]
+
+    if processes > 1 and len(section_ids) > 1:
+        pool = multiprocessing.Pool(min(processes, len(section_ids)))
+        try:
+            pairings = pool.map(pair_section, section_ranks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        pairings = map(pair_section, section_ranks)
+
+    return dict(zip(section_ids, pairings))
+
+
 class Player(models.Model):
     name = models.CharField(max_length=100)
     elo = models.FloatField()
@@ -21,6 +135,18 @@ class Player(models.Model):
     def get_tournament_rank(self, tournament):
         return TournamentRank.objects.get(player=self, tournament=tournament)
 
+    def get_statistics(self):
+        try:
+            return self.playerstats
+        except PlayerStats.DoesNotExist:
+            return None
+
+    def get_history(self):
+        return self.playerhistory_set.select_related('tournament').order_by('tournament')
+
+    def get_opponents(self):
+        return self.head_to_head.filter(games__gt=0).select_related('opponent').order_by('-games', 'opponent')
+
 
 class Matchup(models.Model):
 
@@ -32,6 +158,13 @@ class Matchup(models.Model):
     black_score = models.FloatField(default=0.0)
     white_score = models.FloatField(default=0.0)
 
+    class Meta:
+        index_together = (
+            ('round_group', 'black_score', 'white_score'),
+            ('black', 'black_score'),
+            ('white', 'white_score'),
+        )
+
     def __unicode__(self):
         return '{0} v {1} ({2})'.format(self.white, self.black, self.get_winner())
 
@@ -45,9 +178,53 @@ class Matchup(models.Model):
         else:
             return 'Not played yet'
 
+    def get_result(self):
+        for result, scores in RESULT_SCORES.items():
+            if (self.black_score, self.white_score) == scores:
+                return result
+        return None
+
     def is_not_played(self):
         return self.black_score == self.white_score == 0
 
+    def set_result(self, result):
+        '''
+        the matchup is updated only while it is not played, so a retried or concurrent request
+        for an already played matchup changes nothing. Returns True if the result was recorded.
+        It locks the tournament like recompute_scores does, whose totals would overwrite the result otherwise
+        '''
+        black_score, white_score = RESULT_SCORES[result]
+        tournament_id = self.round_group.tournament_round.tournament_id
+
+        with transaction.atomic():
+            Tournament(id=tournament_id).lock()
+
+            matchups = Matchup.objects.filter(id=self.id)
+            is_recorded = matchups.filter(black_score=0, white_score=0).update(black_score=black_score, white_score=white_score)
+
+            if is_recorded:
+                if black_score:
+                    TournamentRank.objects.filter(id=self.black_id).update(score=F('score') + black_score)
+                if white_score:
+                    TournamentRank.objects.filter(id=self.white_id).update(score=F('score') + white_score)
+                self.update_player_statistics(black_score, white_score)
+
+            self.black_score, self.white_score = matchups.values_list('black_score', 'white_score')[0]
+        return bool(is_recorded)
+
+    def update_player_statistics(self, black_score, white_score):
+        '''
+        adds the game to statistics and head-to-head of both players
+        '''
+        ranks = TournamentRank.objects.filter(id__in=[self.black_id, self.white_id]).values_list('id', 'player_id', 'starting_elo')
+        players = dict((rank_id, (player_id, starting_elo)) for rank_id, player_id, starting_elo in ranks)
+
+        for rank_id, score, opponent_id in ((self.black_id, black_score, self.white_id), (self.white_id, white_score, self.black_id)):
+            player_id, starting_elo = players[rank_id]
+            opponent_player_id, opponent_elo = players[opponent_id]
+            PlayerStats.record_game(score, opponent_elo, player_id=player_id)
+            HeadToHead.record_game(score, opponent_elo, player_id=player_id, opponent_id=opponent_player_id)
+
 
 class Round(models.Model):
 
@@ -56,6 +233,11 @@ class Round(models.Model):
 
     nonplayer = models.ForeignKey(Player, null=True, blank=True)
 
+    class Meta:
+        unique_together = (
+            ('tournament', 'number'),
+        )
+
     def __unicode__(self):
         return 'Round #{0}'.format(self.number)
 
@@ -63,10 +245,33 @@ class Round(models.Model):
         return '/swiss/round/{0}/'.format(self.pk)
 
     def is_finished(self):
-        round_groups = self.roundgroup_set.all()
-        matchups = Matchup.objects.filter(round_group__in=round_groups, black_score=0, white_score=0)
+        matchups = Matchup.objects.filter(round_group__tournament_round=self, black_score=0, white_score=0)
         return not matchups.exists()
 
+    def get_matchups(self):
+        archive = self.tournament.get_archive()
+        if archive:
+            groups = sorted(
+                archive.get_round_groups(self),
+                key=lambda group: (group.section.number if group.section else 0, -group.score_value),
+            )
+            matchups = []
+            for group in groups:
+                matchups.extend(group.get_matchups())
+            return matchups
+        return Matchup.objects.filter(round_group__tournament_round=self).select_related(
+            'round_group', 'black__player', 'white__player'
+        ).order_by('round_group__section__number', '-round_group__score_value', 'id')
+
+    def get_groups(self):
+        archive = self.tournament.get_archive()
+        if archive:
+            return archive.get_round_groups(self)
+        return self.roundgroup_set.select_related('section').order_by('section__number', 'id')
+
+    def get_byes(self):
+        return self.bye_set.select_related('section', 'player__player').order_by('section__number')
+
     def get_next_round(self):
         try:
             return Round.objects.get(tournament=self.tournament, number=self.number+1)
@@ -76,60 +281,84 @@ class Round(models.Model):
     def is_latest(self):
         return self.number == self.tournament.number_of_rounds
 
-    def set_nonplayer(self, loted_players):
-        tournament_ranks = TournamentRank.objects.filter(tournament=self.tournament)
-        nonplayer_as_list = list(set(tournament_ranks) - set(loted_players))
+    def save_pairings(self, pairings):
+        '''
+        writes {section id: pair_section result} of every section with a few bulk inserts
+        '''
+        section_numbers = dict(Section.objects.filter(tournament=self.tournament_id).values_list('id', 'number'))
+        groups = []
+        for section_id in sorted(pairings):
+            paired_groups, bye_id = pairings[section_id]
+            for score_value, lots, pairs in paired_groups:
+                groups.append(RoundGroup(
+                    tournament_round=self,
+                    section_id=section_id,
+                    section_number=section_numbers.get(section_id, 0),
+                    score_value=score_value,
+                ))
+        RoundGroup.objects.bulk_create(groups)
+
+        group_ids = {}
+        for section_id, score_value, round_group_id in self.roundgroup_set.values_list('section_id', 'score_value', 'id'):
+            group_ids[(section_id, score_value)] = round_group_id
+
+        lots_to_bulk = []
+        matchups_to_bulk = []
+        for section_id, (paired_groups, bye_id) in pairings.items():
+            for score_value, lots, pairs in paired_groups:
+                round_group_id = group_ids[(section_id, score_value)]
+                for rank_id, is_shifted in lots:
+                    lots_to_bulk.append(Lot(player_id=rank_id, round_group_id=round_group_id, is_shifted=is_shifted))
+                for black_id, white_id in pairs:
+                    matchups_to_bulk.append(Matchup(black_id=black_id, white_id=white_id, round_group_id=round_group_id))
+
+        Lot.objects.bulk_create(lots_to_bulk)
+        Matchup.objects.bulk_create(matchups_to_bulk)
+
+        # so that recording the results only updates head-to-head rows
+        player_ids = dict(TournamentRank.objects.filter(tournament=self.tournament_id).values_list('id', 'player_id'))
+        HeadToHead.create_missing([(player_ids[matchup.black_id], player_ids[matchup.white_id]) for matchup in matchups_to_bulk])
+
+        self.set_byes(dict((section_id, bye_id) for section_id, (paired_groups, bye_id) in pairings.items() if bye_id))
+
+    def set_byes(self, byes):
+        '''
+        byes is {section id: rank id}. A tournament without sections keeps its bye in nonplayer
+        '''
+        if not byes:
+            return
+        TournamentRank.objects.filter(id__in=byes.values()).update(score=F('score') + SCORE_FOR_NONPLAY)
 
-        if nonplayer_as_list:
-            nonplayer = nonplayer_as_list[0]
-            nonplayer.score += SCORE_FOR_NONPLAY
-            nonplayer.save()
-            self.nonplayer = nonplayer.player
+        if None in byes:
+            self.nonplayer_id = TournamentRank.objects.filter(id=byes.pop(None)).values_list('player_id', flat=True)[0]
             self.save()
-            return nonplayer
-        else:
-            return None
+
+        Bye.objects.bulk_create([
+            Bye(tournament_round=self, section_id=section_id, player_id=rank_id) for section_id, rank_id in byes.items()
+        ])
 
 
 class RoundGroup(models.Model):
     tournament_round = models.ForeignKey(Round)
+    section = models.ForeignKey('Section', null=True, blank=True)
+    # number of the section, 0 without sections: unlike the nullable section it keeps score values
+    # unique in a single pool too, NULLs never collide in a unique index
+    section_number = models.PositiveIntegerField(default=0)
     score_value = models.FloatField()
 
     class Meta:
         unique_together = (
-            ('tournament_round', 'score_value'),
+            ('tournament_round', 'section_number', 'score_value'),
         )
 
     def __unicode__(self):
         return '{0} - {1} score'.format(self.tournament_round, self.score_value)
 
-    def generate_matchups(self):
-        group_lots = self.lot_set.all().select_related('player').order_by('-player__score', '-player__starting_elo')
-        played_lots = []
-        matchups = []
-
-        for number in range(len(group_lots) / 2):
-
-            black = group_lots[number]
-            white = group_lots[len(group_lots)/2+number]
-            
-            matchups.append(
-                Matchup(
-                    black=black.player,
-                    white=white.player,
-                    round_group=self,
-                )
-            )
-            played_lots.append(black)
-            played_lots.append(white)
-
-        return matchups, played_lots
-
     def get_lots(self):
-        return Lot.objects.filter(round_group=self).select_related('player')
+        return Lot.objects.filter(round_group=self).select_related('player__player')
 
     def get_matchups(self):
-        return Matchup.objects.filter(round_group=self).select_related('black', 'white')
+        return Matchup.objects.filter(round_group=self).select_related('black__player', 'white__player')
 
 
 class TournamentRank(models.Model):
@@ -137,6 +366,7 @@ class TournamentRank(models.Model):
     rank = models.PositiveIntegerField()
     score = models.FloatField(default=0.0)
     tournament = models.ForeignKey('Tournament', null=True, blank=True)
+    section = models.ForeignKey('Section', null=True, blank=True)
 
     starting_elo = models.FloatField(default=0.0)
     final_elo = models.FloatField(default=0.0)
@@ -147,10 +377,25 @@ class TournamentRank(models.Model):
         unique_together = (
             ('tournament', 'player'),
         )
+        index_together = (
+            ('tournament', 'score', 'buchholz_factor', 'rank'),
+        )
 
     def __unicode__(self):
         return '{0} - {1} - {2}'.format(self.rank, self.player.name, self.player.elo)
 
+    @classmethod
+    def bulk_set(cls, field, values):
+        '''
+        writes {rank id: value} with one UPDATE per distinct value instead of one per rank --
+        scores and Buchholz factors take just a few distinct values within a tournament
+        '''
+        ids_by_value = {}
+        for rank_id, value in values.items():
+            ids_by_value.setdefault(value, []).append(rank_id)
+        for value, rank_ids in ids_by_value.items():
+            cls.objects.filter(id__in=rank_ids).update(**{field: value})
+
     def get_buchholz_factor(self):
         from django.db.models import Sum
         white_score = Matchup.objects.filter(black=self).aggregate(Sum('white__score'))
@@ -203,22 +448,51 @@ class Tournament(models.Model):
         return '/swiss/tournament/{0}/'.format(self.pk)
 
     @classmethod
-    def start_tournament(cls, players, number_of_winners):
+    @transaction.atomic
+    def start_tournament(cls, players, number_of_winners, rating_bands=()):
+        '''
+        rating_bands are the lowest Elo of every section but the bottom one: (2200, 1800) splits
+        the players into 2200 and up, 1800-2200 and under 1800. Without them the tournament is one pool
+        '''
         check = datetime.now()
 
-        number_of_rounds = round(math.log(len(players), 2)) + round(math.log(number_of_winners, 2))
+        min_elos = sorted(set(rating_bands), reverse=True)
+        bands = zip([None] + min_elos, min_elos + [None])
+
+        ranked_players = [[] for band in bands]
+        for rank, player in enumerate(players.order_by('-elo')):
+            for number, (max_elo, min_elo) in enumerate(bands):
+                if min_elo is None or player.elo >= min_elo:
+                    ranked_players[number].append((rank+1, player))
+                    break
+
+        section_size = max(len(band_players) for band_players in ranked_players)
+        number_of_rounds = round(math.log(section_size, 2)) + round(math.log(number_of_winners, 2))
         tournament = cls.objects.create(number_of_winners=number_of_winners, number_of_rounds=number_of_rounds)
 
+        sections = {}
+        if min_elos:
+            for number, (max_elo, min_elo) in enumerate(bands):
+                sections[number] = Section.objects.create(
+                    tournament=tournament,
+                    number=number+1,
+                    min_elo=min_elo,
+                    max_elo=max_elo,
+                )
+
         ranks = []
-        for rank, player in enumerate(players.order_by('-elo')):
-            ranks.append(TournamentRank(
-                tournament=tournament,
-                player=player,
-                rank=rank+1,
-                score=0,
-                starting_elo=player.elo,
-            ))
+        for number, band_players in enumerate(ranked_players):
+            for rank, player in band_players:
+                ranks.append(TournamentRank(
+                    tournament=tournament,
+                    section=sections.get(number),
+                    player=player,
+                    rank=rank,
+                    score=0,
+                    starting_elo=player.elo,
+                ))
         TournamentRank.objects.bulk_create(ranks)
+        PlayerStats.create_missing([rank.player_id for rank in ranks])
 
         print 'ranks created', datetime.now() - check
 
@@ -236,58 +510,238 @@ class Tournament(models.Model):
             is_last_round = current_round.number == self.number_of_rounds
         return is_last_round and current_round.is_finished() and not self.is_finished
 
+    def lock(self):
+        '''
+        locks the tournament row until the end of the transaction. It's a no-op update rather than
+        select_for_update: sqlite ignores the latter, but takes its write lock for an update
+        '''
+        Tournament.objects.filter(id=self.pk).update(number_of_rounds=F('number_of_rounds'))
+
+    def get_archive(self):
+        '''
+        only finished tournaments can be archived, so live ones never pay for the lookup
+        '''
+        if not hasattr(self, '_archive'):
+            self._archive = None
+            if self.is_finished:
+                try:
+                    self._archive = self.tournamentarchive
+                except TournamentArchive.DoesNotExist:
+                    pass
+        return self._archive
+
+    def get_final_results(self):
+        final_results = {}
+        for ranked_player in TournamentRank.objects.filter(tournament=self):
+            final_results[ranked_player.id] = (ranked_player.final_elo, ranked_player.buchholz_factor)
+        return final_results
+
+    @tournament_transaction
+    def archive(self):
+        '''
+        moves pairings and results of the finished tournament into one compact summary
+        and deletes its RoundGroup, Lot and Matchup rows from the live tables. The tournament is locked
+        and the archive looked up again, another request may have archived it since it was read
+        '''
+        if not self.is_finished or self.get_archive():
+            return None
+        self.lock()
+        if TournamentArchive.objects.filter(tournament=self).exists():
+            return None
+
+        archive = TournamentArchive(tournament=self)
+        archive.set_summary(TournamentArchive.build_summary(self))
+        archive.save()
+
+        Matchup.objects.filter(round_group__tournament_round__tournament=self).delete()
+        Lot.objects.filter(round_group__tournament_round__tournament=self).delete()
+        RoundGroup.objects.filter(tournament_round__tournament=self).delete()
+
+        self._archive = archive
+        return archive
+
+    @classmethod
+    def archive_finished(cls):
+        archives = []
+        for tournament in cls.objects.filter(is_finished=True, tournamentarchive__isnull=True):
+            archives.append(tournament.archive())
+        return archives
+
+    @classmethod
+    def compute_scores(cls, tournaments):
+        '''
+        {rank id: score} of every rank in the tournaments as follows from recorded matchups,
+        nonplayer rounds and section byes, calculated with aggregate queries
+        '''
+        from django.db.models import Count, Sum
+
+        ranks = TournamentRank.objects.filter(tournament__in=tournaments)
+        matchups = Matchup.objects.filter(round_group__tournament_round__tournament__in=tournaments)
+
+        scores = {}
+        rank_ids = {}
+        for rank_id, tournament_id, player_id in ranks.values_list('id', 'tournament_id', 'player_id'):
+            scores[rank_id] = 0.0
+            rank_ids[(tournament_id, player_id)] = rank_id
+
+        for row in matchups.values('black').annotate(total=Sum('black_score')):
+            scores[row['black']] += row['total']
+        for row in matchups.values('white').annotate(total=Sum('white_score')):
+            scores[row['white']] += row['total']
+
+        nonplayer_rounds = Round.objects.filter(tournament__in=tournaments, nonplayer__isnull=False)
+        for row in nonplayer_rounds.values('tournament', 'nonplayer').annotate(total=Count('id')):
+            scores[rank_ids[(row['tournament'], row['nonplayer'])]] += row['total'] * SCORE_FOR_NONPLAY
+
+        byes = Bye.objects.filter(tournament_round__tournament__in=tournaments)
+        for row in byes.values('player').annotate(total=Count('id')):
+            scores[row['player']] += row['total'] * SCORE_FOR_NONPLAY
+
+        return scores
+
+    @classmethod
+    def recompute_scores(cls, tournaments):
+        '''
+        recalculates scores and Buchholz factors of every rank in the tournaments;
+        archived tournaments have no matchups and are skipped. The tournaments are locked before anything
+        is read in the transaction (a REPEATABLE READ snapshot starts at the first read), so a result is
+        recorded either before the totals are computed or after they are written
+        '''
+        from django.db.models import Sum
+
+        tournament_ids = list(tournaments.order_by('id').values_list('id', flat=True))
+        with transaction.atomic():
+            for tournament_id in tournament_ids:
+                Tournament(id=tournament_id).lock()
+            tournaments = list(Tournament.objects.filter(id__in=tournament_ids, tournamentarchive__isnull=True))
+
+            matchups = Matchup.objects.filter(round_group__tournament_round__tournament__in=tournaments)
+
+            scores = cls.compute_scores(tournaments)
+            TournamentRank.bulk_set('score', scores)
+
+            buchholz_factors = dict.fromkeys(scores, 0.0)
+            for row in matchups.values('black').annotate(total=Sum('white__score')):
+                buchholz_factors[row['black']] += row['total']
+            for row in matchups.values('white').annotate(total=Sum('black__score')):
+                buchholz_factors[row['white']] += row['total']
+
+            TournamentRank.bulk_set('buchholz_factor', buchholz_factors)
+
+        for tournament in tournaments:
+            invalidate_tournament_cache(tournament.pk)
+
+        return len(scores)
+
     def get_ranked_players(self):
-        ranked_players = TournamentRank.objects.filter(tournament=self).order_by('-score', '-buchholz_factor')
+        ranked_players = TournamentRank.objects.filter(tournament=self).select_related('player').order_by(
+            '-score', '-buchholz_factor', 'rank'
+        )
         return ranked_players
 
+    def get_standings(self):
+        '''
+        [(section, ranked players)], a single (None, ranked players) for a tournament without sections
+        '''
+        sections = list(self.section_set.order_by('number'))
+        if not sections:
+            return [(None, self.get_ranked_players())]
+        return [(section, section.get_ranked_players()) for section in sections]
+
+    def get_places(self):
+        '''
+        {rank id: place in the standings of its section}
+        '''
+        places = {}
+        for section, ranked_players in self.get_standings():
+            for place, rank_id in enumerate(ranked_players.values_list('id', flat=True)):
+                places[rank_id] = place + 1
+        return places
+
+    def get_games(self):
+        '''
+        (black rank id, white rank id, black score, white score) of every matchup, live or archived
+        '''
+        archive = self.get_archive()
+        if archive:
+            games = []
+            for summary_round in archive.get_summary()['rounds']:
+                for group in summary_round['groups']:
+                    for matchup_id, black_id, white_id, black_score, white_score in group['matchups']:
+                        games.append((black_id, white_id, black_score, white_score))
+            return games
+        matchups = Matchup.objects.filter(round_group__tournament_round__tournament=self)
+        return matchups.values_list('black_id', 'white_id', 'black_score', 'white_score')
+
+    def get_section_ranks(self):
+        '''
+        {section id: ranks to pair, see pair_section}; the section id is None for a tournament without sections
+        '''
+        sections = {}
+        ranks = TournamentRank.objects.filter(tournament=self).order_by('id')
+        for section_id, rank_id, score, starting_elo in ranks.values_list('section_id', 'id', 'score', 'starting_elo'):
+            sections.setdefault(section_id, []).append((rank_id, score, starting_elo))
+        return sections
+
+    def get_pairing_processes(self, sections):
+        if sum(len(ranks) for ranks in sections.values()) < PARALLEL_PAIRING_MIN_PLAYERS:
+            return 1
+        return multiprocessing.cpu_count()
+
     def get_current_round(self):
         try:
             return Round.objects.filter(tournament=self).latest('number')
         except Round.DoesNotExist:
             return None
 
+    @tournament_transaction
     def start_next_round(self):
+        '''
+        the tournament is locked while the round is paired. A round that is not finished yet,
+        or the last one, is returned as is -- so a second judge or a retried request gets the round
+        the first one started instead of a duplicate
+        '''
         check = datetime.now()
+        self.lock()
         current_round = self.get_current_round()
 
         if current_round:
+            if not current_round.is_finished() or current_round.number >= self.number_of_rounds:
+                return current_round
             new_round_number = current_round.number + 1
         else:
             new_round_number = 1
 
-        tournament_round = Round.objects.create(tournament=self, number=new_round_number)
+        try:
+            with transaction.atomic():
+                tournament_round = Round.objects.create(tournament=self, number=new_round_number)
+        except IntegrityError:
+            # databases without row locks: the round was created by a concurrent request
+            return Round.objects.get(tournament=self, number=new_round_number)
 
         print 'lots and rounds created in', datetime.now() - check
 
         check = datetime.now()
 
-        proxy_groups = RoundGroupProxyList(RoundGroupProxy.get_round_groups(tournament_round))
-        groups = proxy_groups.save_round_groups()
+        sections = self.get_section_ranks()
+        pairings = pair_sections(sections, self.get_pairing_processes(sections))
 
-        print 'groups created in', datetime.now() - check
+        print 'sections paired in', datetime.now() - check
 
         check = datetime.now()
 
-        loted_players = []
-        matchups_to_bulk = []
-        for group in groups:
-            matchups, played_lots = group.generate_matchups()
-            matchups_to_bulk.extend(matchups)
-            loted_players.extend([lot.player for lot in played_lots])
-
-        Matchup.objects.bulk_create(matchups_to_bulk)
-
-        print 'matchups created', datetime.now() - check
-
-        check = datetime.now()
+        tournament_round.save_pairings(pairings)
 
-        tournament_round.set_nonplayer(loted_players)
-
-        print 'nonplayer modified in', datetime.now() - check
+        print 'groups, lots, matchups and byes created in', datetime.now() - check
 
         return tournament_round
 
+    @tournament_transaction
     def finish_tournament(self):
+        '''
+        is_finished is claimed with a conditional update before anything is calculated,
+        so Elo ratings are changed once; repeated calls return the stored results
+        '''
 
         def get_ev(tournament_rank1, tournament_rank2):
             '''
@@ -301,21 +755,36 @@ class Tournament(models.Model):
             return res
 
         check = datetime.now()
+        if not Tournament.objects.filter(id=self.pk, is_finished=False).update(is_finished=True):
+            self.is_finished = True
+            return self.get_final_results()
+
         tournament_ranks = TournamentRank.objects.filter(tournament=self)
 
         final_results = {}
+        histories = {}
 
         for ranked_player in tournament_ranks:
             matchups = Matchup.objects.filter(Q(black=ranked_player)|Q(white=ranked_player)).select_related('black', 'white')
+            history = PlayerHistory(
+                player_id=ranked_player.player_id,
+                tournament=self,
+                starting_elo=ranked_player.starting_elo,
+                final_score=ranked_player.score,
+            )
             expected_values = []
             opponents_scores = []
             for matchup in matchups:
                 if ranked_player == matchup.black:
                     expected_value = get_ev(ranked_player, matchup.white)
                     opponents_scores.append(matchup.white.score)
+                    if not matchup.is_not_played():
+                        history.add_game(matchup.black_score, matchup.white.starting_elo)
                 elif ranked_player == matchup.white:
                     expected_value = get_ev(ranked_player, matchup.black)
                     opponents_scores.append(matchup.black.score)
+                    if not matchup.is_not_played():
+                        history.add_game(matchup.white_score, matchup.black.starting_elo)
 
                 expected_values.append(expected_value)
 
@@ -327,36 +796,385 @@ class Tournament(models.Model):
             ranked_player.save()
 
             final_results[ranked_player.id] = (final_elo, buchholz_factor)
-        
+            history.final_elo = final_elo
+            history.buchholz_factor = buchholz_factor
+            histories[ranked_player.id] = history
+
+        places = self.get_places()
+        for rank_id, history in histories.items():
+            history.place = places[rank_id]
+        PlayerHistory.objects.bulk_create(histories.values())
+
+        player_ids = [history.player_id for history in histories.values()]
+        PlayerStats.objects.filter(player__in=player_ids).update(tournaments_played=F('tournaments_played') + 1)
 
         self.is_finished = True
-        self.save()
 
         print 'new Elo ratings and Buchholz factors has been calculated in', datetime.now() - check
 
         return final_results
 
 
-class RoundGroupProxy(object):
+class Section(models.Model):
+    '''
+    rating band of an open: its players are ranked, paired and get byes only among themselves
+    '''
+    tournament = models.ForeignKey(Tournament)
+    number = models.PositiveIntegerField()
 
-    def __init__(self, tournament_round, score_value):
-        self.score_value = score_value
-        self.tournament_round = tournament_round
+    min_elo = models.FloatField(null=True, blank=True)
+    max_elo = models.FloatField(null=True, blank=True)
 
-        ranks = []
-        for rank in tournament_round.tournament.tournamentrank_set.filter(score=score_value):
-            ranks.append([rank, None])
+    class Meta:
+        unique_together = (
+            ('tournament', 'number'),
+        )
 
-        if [rank[0].score for rank in ranks] == [0]*len(ranks):
-            self.ranks = sorted(ranks, key=lambda rank: rank[0].player.elo)
-        else:
-            self.ranks = sorted(ranks, key=lambda rank: rank[0].score)
+    def __unicode__(self):
+        if self.min_elo is None:
+            return 'Section #{0} (Elo under {1})'.format(self.number, self.max_elo)
+        elif self.max_elo is None:
+            return 'Section #{0} (Elo {1} and up)'.format(self.number, self.min_elo)
+        return 'Section #{0} (Elo {1}-{2})'.format(self.number, self.min_elo, self.max_elo)
+
+    def get_ranked_players(self):
+        return self.tournament.get_ranked_players().filter(section=self)
 
-        self.round_group = self.save_round_group()
+
+class Bye(models.Model):
+    '''
+    player of a section getting the score without a game in the round.
+    A tournament without sections keeps its bye in Round.nonplayer
+    '''
+    tournament_round = models.ForeignKey(Round)
+    section = models.ForeignKey(Section)
+    player = models.ForeignKey(TournamentRank)
+
+    class Meta:
+        unique_together = (
+            ('tournament_round', 'section'),
+        )
+
+    def __unicode__(self):
+        return '{0}: {1} in {2}'.format(self.tournament_round, self.player.player.name, self.section)
+
+
+class GameStatistics(models.Model):
+    '''
+    game counters of the player statistics tables. They are denormalized: updated as results
+    are recorded, so player pages read one row instead of the player's whole game history
+    '''
+    games = models.PositiveIntegerField(default=0)
+    wins = models.PositiveIntegerField(default=0)
+    draws = models.PositiveIntegerField(default=0)
+    losses = models.PositiveIntegerField(default=0)
+    score = models.FloatField(default=0.0)
+    opponents_elo_sum = models.FloatField(default=0.0)
+
+    class Meta:
+        abstract = True
+
+    @staticmethod
+    def get_increments(score, opponent_elo):
+        return {
+            'games': 1,
+            'wins': int(score == SCORE_FOR_WIN),
+            'draws': int(score == SCORE_FOR_DRAW),
+            'losses': int(score == 0),
+            'score': score,
+            'opponents_elo_sum': opponent_elo,
+        }
+
+    @classmethod
+    def record_game(cls, score, opponent_elo, **lookup):
+        '''
+        adds the game to the row found by lookup with F() increments. The rows are created when players
+        are entered and paired (see create_missing): inserting here would take InnoDB gap locks that
+        deadlock judges recording results at the same time
+        '''
+        increments = cls.get_increments(score, opponent_elo)
+        cls.objects.filter(**lookup).update(**dict((field, F(field) + value) for field, value in increments.items()))
+
+    def add_game(self, score, opponent_elo):
+        for field, value in self.get_increments(score, opponent_elo).items():
+            setattr(self, field, getattr(self, field) + value)
+
+    def get_performance_rating(self):
+        '''
+        average Elo of the opponents, plus 400 for every win and minus 400 for every loss per game
+        '''
+        if not self.games:
+            return None
+        return round((self.opponents_elo_sum + 400 * (self.wins - self.losses)) / self.games, 2)
+
+
+class PlayerStats(GameStatistics):
+    player = models.OneToOneField(Player)
+    tournaments_played = models.PositiveIntegerField(default=0)
+
+    def __unicode__(self):
+        return 'Statistics of {0}'.format(self.player.name)
+
+    @classmethod
+    def create_missing(cls, player_ids):
+        existing_ids = set(cls.objects.filter(player__in=player_ids).values_list('player_id', flat=True))
+        missing_ids = set(player_ids) - existing_ids
+        try:
+            with transaction.atomic():
+                cls.objects.bulk_create([cls(player_id=player_id) for player_id in missing_ids])
+        except IntegrityError:
+            # some were created by a concurrent request in between
+            for player_id in missing_ids:
+                cls.objects.get_or_create(player_id=player_id)
 
     @classmethod
-    def get_round_groups(cls, tournament_round):
-        ranks = tournament_round.tournament.tournamentrank_set.all()
+    @transaction.atomic
+    def rebuild(cls):
+        '''
+        recalculates statistics, history and head-to-head of every player from tournament ranks,
+        matchups and archives -- for games recorded before these tables existed
+        '''
+        cls.objects.all().delete()
+        PlayerHistory.objects.all().delete()
+        HeadToHead.objects.all().delete()
+
+        statistics = {}
+        histories = []
+        head_to_head = {}
+
+        for tournament in Tournament.objects.order_by('id'):
+            ranks = dict((rank.id, rank) for rank in TournamentRank.objects.filter(tournament=tournament))
+            tournament_histories = {}
+            for rank in ranks.values():
+                player_statistics = statistics.setdefault(rank.player_id, cls(player_id=rank.player_id))
+                if tournament.is_finished:
+                    player_statistics.tournaments_played += 1
+                    tournament_histories[rank.id] = PlayerHistory(
+                        player_id=rank.player_id,
+                        tournament=tournament,
+                        starting_elo=rank.starting_elo,
+                        final_elo=rank.final_elo,
+                        final_score=rank.score,
+                        buchholz_factor=rank.buchholz_factor,
+                    )
+
+            for black_id, white_id, black_score, white_score in tournament.get_games():
+                # unplayed games get their rows too, recording their results only updates them
+                for rank_id, opponent_id in ((black_id, white_id), (white_id, black_id)):
+                    key = (ranks[rank_id].player_id, ranks[opponent_id].player_id)
+                    head_to_head.setdefault(key, HeadToHead(player_id=key[0], opponent_id=key[1]))
+                if black_score == white_score == 0:
+                    continue
+                for rank_id, score, opponent_id in ((black_id, black_score, white_id), (white_id, white_score, black_id)):
+                    rank, opponent = ranks[rank_id], ranks[opponent_id]
+                    statistics[rank.player_id].add_game(score, opponent.starting_elo)
+                    head_to_head[(rank.player_id, opponent.player_id)].add_game(score, opponent.starting_elo)
+                    if rank_id in tournament_histories:
+                        tournament_histories[rank_id].add_game(score, opponent.starting_elo)
+
+            if tournament_histories:
+                places = tournament.get_places()
+                for rank_id, history in tournament_histories.items():
+                    history.place = places[rank_id]
+                histories.extend(tournament_histories.values())
+
+        cls.objects.bulk_create(statistics.values())
+        PlayerHistory.objects.bulk_create(histories)
+        HeadToHead.objects.bulk_create(head_to_head.values())
+        return len(statistics)
+
+
+class PlayerHistory(GameStatistics):
+    '''
+    one finished tournament of the player, written by finish_tournament
+    '''
+    player = models.ForeignKey(Player)
+    tournament = models.ForeignKey(Tournament)
+
+    place = models.PositiveIntegerField(default=0)
+    final_score = models.FloatField(default=0.0)
+    buchholz_factor = models.FloatField(default=0.0)
+    starting_elo = models.FloatField(default=0.0)
+    final_elo = models.FloatField(default=0.0)
+
+    class Meta:
+        unique_together = (
+            ('player', 'tournament'),
+        )
+
+    def __unicode__(self):
+        return '{0} in {1}'.format(self.player.name, self.tournament)
+
+    def get_elo_change(self):
+        return round(self.final_elo - self.starting_elo, 2)
+
+
+class HeadToHead(GameStatistics):
+    '''
+    games of the player against one opponent; every game is counted in two rows, one for each side
+    '''
+    player = models.ForeignKey(Player, related_name='head_to_head')
+    opponent = models.ForeignKey(Player, related_name='+')
+
+    class Meta:
+        unique_together = (
+            ('player', 'opponent'),
+        )
+        index_together = (
+            ('player', 'games'),
+        )
+
+    def __unicode__(self):
+        return '{0} v {1}'.format(self.player.name, self.opponent.name)
+
+    @classmethod
+    def create_missing(cls, pairs):
+        '''
+        zeroed rows for both sides of every (player id, opponent id) pair. Both sides are always created
+        together, so only one side of each pair is looked up, by the unique index, a batch of pairs a query
+        '''
+        pairs = list(set(tuple(sorted(pair)) for pair in pairs))
+        existing = set()
+        for start in range(0, len(pairs), HEAD_TO_HEAD_LOOKUP_BATCH):
+            lookup = reduce(operator.or_, [
+                Q(player=player_id, opponent=opponent_id) for player_id, opponent_id in pairs[start:start + HEAD_TO_HEAD_LOOKUP_BATCH]
+            ])
+            existing.update(cls.objects.filter(lookup).values_list('player_id', 'opponent_id'))
+
+        missing = []
+        for player_id, opponent_id in set(pairs) - existing:
+            missing.extend([(player_id, opponent_id), (opponent_id, player_id)])
+        try:
+            with transaction.atomic():
+                cls.objects.bulk_create([cls(player_id=player_id, opponent_id=opponent_id) for player_id, opponent_id in missing])
+        except IntegrityError:
+            # some were created by a concurrent request in between
+            for player_id, opponent_id in missing:
+                cls.objects.get_or_create(player_id=player_id, opponent_id=opponent_id)
+
+
+class TournamentArchive(models.Model):
+    '''
+    compact summary of a finished tournament: every round as it was paired, with results.
+    Standings, Elo changes and the crosstable come from the kept TournamentRank rows, the summary refers to them by id
+    '''
+    tournament = models.OneToOneField(Tournament)
+    summary = models.BinaryField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __unicode__(self):
+        return 'Archive of {0}'.format(self.tournament)
+
+    def get_summary(self):
+        if not hasattr(self, '_summary'):
+            self._summary = json.loads(zlib.decompress(bytes(self.summary)))
+        return self._summary
+
+    def set_summary(self, summary):
+        self._summary = summary
+        self.summary = zlib.compress(json.dumps(summary, separators=(',', ':')))
+
+    @staticmethod
+    def build_summary(tournament):
+        round_numbers = dict(Round.objects.filter(tournament=tournament).values_list('id', 'number'))
+        groups = RoundGroup.objects.filter(tournament_round__tournament=tournament).order_by('id')
+        lots = Lot.objects.filter(round_group__tournament_round__tournament=tournament).order_by('id')
+        matchups = Matchup.objects.filter(round_group__tournament_round__tournament=tournament).order_by('id')
+
+        rounds = dict((number, {'number': number, 'groups': []}) for number in round_numbers.values())
+        summary_groups = {}
+        group_fields = ('id', 'tournament_round_id', 'section_id', 'score_value')
+        for round_group_id, tournament_round_id, section_id, score_value in groups.values_list(*group_fields):
+            summary_groups[round_group_id] = {'score_value': score_value, 'section': section_id, 'lots': [], 'matchups': []}
+            rounds[round_numbers[tournament_round_id]]['groups'].append(summary_groups[round_group_id])
+
+        for round_group_id, player_id, is_shifted in lots.values_list('round_group_id', 'player_id', 'is_shifted'):
+            summary_groups[round_group_id]['lots'].append([player_id, is_shifted])
+
+        matchup_fields = ('id', 'round_group_id', 'black_id', 'white_id', 'black_score', 'white_score')
+        for matchup_id, round_group_id, black_id, white_id, black_score, white_score in matchups.values_list(*matchup_fields):
+            summary_groups[round_group_id]['matchups'].append([matchup_id, black_id, white_id, black_score, white_score])
+
+        return {
+            'rounds': [rounds[number] for number in sorted(rounds)],
+        }
+
+    def get_ranks(self):
+        if not hasattr(self, '_ranks'):
+            ranks = TournamentRank.objects.filter(tournament_id=self.tournament_id).select_related('player')
+            self._ranks = dict((rank.id, rank) for rank in ranks)
+        return self._ranks
+
+    def get_sections(self):
+        if not hasattr(self, '_sections'):
+            self._sections = dict((section.id, section) for section in Section.objects.filter(tournament_id=self.tournament_id))
+        return self._sections
+
+    def get_round_groups(self, tournament_round):
+        ranks = self.get_ranks()
+        sections = self.get_sections()
+        for summary_round in self.get_summary()['rounds']:
+            if summary_round['number'] == tournament_round.number:
+                return [ArchivedRoundGroup(tournament_round, group, ranks, sections) for group in summary_round['groups']]
+        return []
+
+
+class ArchivedRoundGroup(object):
+    '''
+    stands in for RoundGroup in round pages of archived tournaments: lots and matchups are
+    unsaved model instances built from the archive summary
+    '''
+
+    def __init__(self, tournament_round, summary_group, ranks, sections):
+        self.score_value = summary_group['score_value']
+        self.section = sections.get(summary_group.get('section'))
+        self.round_group = RoundGroup(
+            tournament_round=tournament_round,
+            section=self.section,
+            section_number=self.section.number if self.section else 0,
+            score_value=self.score_value,
+        )
+
+        self.lots = []
+        for player_id, is_shifted in summary_group['lots']:
+            self.lots.append(Lot(player=ranks[player_id], round_group=self.round_group, is_shifted=is_shifted))
+
+        self.matchups = []
+        for matchup_id, black_id, white_id, black_score, white_score in summary_group['matchups']:
+            self.matchups.append(Matchup(
+                id=matchup_id,
+                round_group=self.round_group,
+                black=ranks[black_id],
+                white=ranks[white_id],
+                black_score=black_score,
+                white_score=white_score,
+            ))
+
+    def __repr__(self):
+        return '{0} score archived group'.format(self.score_value)
+
+    def get_lots(self):
+        return self.lots
+
+    def get_matchups(self):
+        return self.matchups
+
+
+class RoundGroupProxy(object):
+    '''
+    score group of the round being paired. Works on plain rank tuples (see pair_section)
+    and never touches the database, so sections can be paired in worker processes
+    '''
+
+    def __init__(self, score_value, ranks):
+        self.score_value = score_value
+        self.ranks = [[rank, None] for rank in ranks]
+
+        if not score_value:
+            self.ranks.sort(key=lambda rank: rank[0][RANK_STARTING_ELO])
+
+    @classmethod
+    def get_round_groups(cls, ranks):
 
         def evenify_groups(groups):
             rank = None
@@ -369,11 +1187,12 @@ class RoundGroupProxy(object):
                     rank = None
             return groups
 
-        unique_score_values = [player_rank['score'] for player_rank in ranks.values('score').distinct()]
-        groups = [cls(tournament_round, score_value) for score_value in unique_score_values]
-        sorted_groups = sorted(groups, key=lambda group: group.score_value)
+        ranks_by_score = {}
+        for rank in ranks:
+            ranks_by_score.setdefault(rank[RANK_SCORE], []).append(rank)
+        groups = [cls(score_value, ranks_by_score[score_value]) for score_value in sorted(ranks_by_score)]
 
-        return evenify_groups(sorted_groups)
+        return evenify_groups(groups)
 
     def __repr__(self):
         return '{0} score group'.format(self.score_value)
@@ -381,7 +1200,7 @@ class RoundGroupProxy(object):
     def add_rank(self, rank):
         if rank or self.ranks:
             self.ranks.append(rank)
-            self.ranks = sorted(self.ranks, key=lambda rank: rank[0].score)        
+            self.ranks = sorted(self.ranks, key=lambda rank: rank[0][RANK_SCORE])
 
     def pop_rank(self):
         rank = self.ranks[0]
@@ -389,31 +1208,10 @@ class RoundGroupProxy(object):
         self.ranks.remove(rank)
         return rank
 
-    def save_round_group(self):
-        round_group = RoundGroup.objects.create(
-            score_value=self.score_value,
-            tournament_round=self.tournament_round
-        )
-        return round_group
-
-
-class RoundGroupProxyList(list):
-
-    def save_round_groups(self):
-        round_groups = []
-        round_group_lots = []
-
-        for group in self:
-            round_groups.append(group.round_group)
-            for rank in group.ranks:
-                round_group_lots.append(
-                    Lot(
-                        player=rank[0],
-                        round_group=group.round_group,
-                        is_shifted=(rank[1] == 'shifted'),
-                    )
-                )
-
-        Lot.objects.bulk_create(round_group_lots)
-
-        return round_groups
+    def get_pairs(self):
+        '''
+        (black id, white id) pairs: the top half of the group by score and starting elo plays the bottom half
+        '''
+        ranks = sorted([rank for rank, is_shifted in self.ranks], key=lambda rank: (-rank[RANK_SCORE], -rank[RANK_STARTING_ELO]))
+        half = len(ranks) / 2
+        return [(ranks[number][RANK_ID], ranks[half + number][RANK_ID]) for number in range(half)]
@@ -1,6 +1,20 @@
-from django.test import TestCase, Client
+import json
+import operator
+import random
+import threading
 
-from swiss.models import Player, Tournament, Round, Matchup, RoundGroup
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import IntegrityError, connection
+from django.db.models import Q, Sum
+from django.test import TestCase, TransactionTestCase, Client
+
+from swiss.models import Player, Tournament, Round, Matchup, RoundGroup, TournamentRank
+from swiss.models import PlayerStats, PlayerHistory, HeadToHead, TournamentArchive
+from swiss.models import RESULT_SCORES, SCORE_FOR_WIN, TOURNAMENT_CACHE_VERSION_KEY, pair_sections
+from swiss.models import get_tournament_cache_version, invalidate_tournament_cache
+from swiss import models
+from swiss.loadtest import LoadTest, WsgiTransport, get_percentile
 from fixt import createplayers
 
 class TournamentTestCase(TestCase):
@@ -39,3 +53,668 @@ class TournamentTestCase(TestCase):
         self.assertEqual(Matchup.objects.all().count(), 10)
             
         self.assertEqual(RoundGroup.objects.all().count(), 4)
+
+
+class ApiTestCase(TestCase):
+
+    def setUp(self):
+        createplayers()
+        self.tournament = Tournament.start_tournament(Player.objects.all(), 1)
+        self.client = Client()
+
+    def test_standings_pagination(self):
+        response = self.client.get('/swiss/api/tournament/{0}/standings/?limit=4&fields=position,id'.format(self.tournament.id))
+        self.assertEqual(response.status_code, 200)
+        page = json.loads(response.content)
+
+        ids = [row['id'] for row in page['standings']]
+        while page['next_cursor']:
+            response = self.client.get('/swiss/api/tournament/{0}/standings/?limit=4&fields=position,id&cursor={1}'.format(
+                self.tournament.id, page['next_cursor']))
+            page = json.loads(response.content)
+            self.assertEqual(page['standings'][0]['position'], len(ids) + 1)
+            ids.extend(row['id'] for row in page['standings'])
+
+        self.assertEqual(ids, [ranked_player.id for ranked_player in self.tournament.get_ranked_players()])
+
+    def test_compact_round(self):
+        tournament_round = self.tournament.get_current_round()
+        response = self.client.get('/swiss/api/round/{0}/?format=compact&fields=id,result'.format(tournament_round.id))
+        payload = json.loads(response.content)
+
+        self.assertEqual(payload['matchups']['fields'], ['id', 'result'])
+        self.assertEqual(len(payload['matchups']['rows']), 5)
+
+    def test_cache_is_dropped_on_result(self):
+        tournament_round = self.tournament.get_current_round()
+        url = '/swiss/api/round/{0}/?fields=id,result'.format(tournament_round.id)
+        self.client.get(url)
+
+        User.objects.create_user('judge', password='judge')
+        self.client.login(username='judge', password='judge')
+        matchup = tournament_round.get_matchups()[0]
+        self.client.get('/swiss/matchup/{0}/draw/'.format(matchup.id))
+
+        results = dict((row['id'], row['result']) for row in json.loads(self.client.get(url).content)['matchups'])
+        self.assertEqual(results[matchup.id], 'Draw')
+
+    def test_cache_version_is_not_reused_after_eviction(self):
+        tournament_round = self.tournament.get_current_round()
+        url = '/swiss/api/round/{0}/?fields=id,result'.format(tournament_round.id)
+        version_key = TOURNAMENT_CACHE_VERSION_KEY.format(self.tournament.id)
+
+        User.objects.create_user('judge', password='judge')
+        self.client.login(username='judge', password='judge')
+        matchups = list(tournament_round.get_matchups())
+
+        for number, matchup in enumerate(matchups[:2]):
+            self.client.get(url)
+            self.client.get('/swiss/matchup/{0}/draw/'.format(matchup.id))
+            self.client.get(url)
+            cache.delete(version_key)
+
+            results = [row['result'] for row in json.loads(self.client.get(url).content)['matchups']]
+            self.assertEqual(results.count('Draw'), number + 1)
+
+    def test_reseeded_cache_version_is_new(self):
+        version_key = TOURNAMENT_CACHE_VERSION_KEY.format(self.tournament.id)
+        version = get_tournament_cache_version(self.tournament.id)
+        for number in range(1000):
+            invalidate_tournament_cache(self.tournament.id)
+        cache.delete(version_key)
+
+        self.assertFalse(version <= get_tournament_cache_version(self.tournament.id) <= version + 1000)
+
+    def test_unknown_field(self):
+        response = self.client.get('/swiss/api/tournament/{0}/?fields=nope'.format(self.tournament.id))
+        self.assertEqual(response.status_code, 400)
+
+
+class ArchiveTestCase(TestCase):
+
+    def setUp(self):
+        createplayers()
+        User.objects.create_user('judge', password='judge')
+        self.client = Client()
+        self.client.login(username='judge', password='judge')
+
+        self.tournament = self.play_tournament(Tournament.start_tournament(Player.objects.all(), 1))
+
+    def play_tournament(self, tournament):
+        tournament = Tournament.objects.get(id=tournament.id)
+        for number in range(tournament.number_of_rounds):
+            if number:
+                self.client.get('/swiss/start_next_round/{0}/'.format(tournament.id))
+            for matchup in tournament.get_current_round().get_matchups():
+                self.client.get('/swiss/matchup/{0}/white/'.format(matchup.id))
+        self.client.get('/swiss/final_calcs/{0}/'.format(tournament.id))
+        return Tournament.objects.get(id=tournament.id)
+
+    def test_archive(self):
+        tournament_round = self.tournament.get_current_round()
+        round_url = '/swiss/api/round/{0}/?format=compact'.format(tournament_round.id)
+        live_round = json.loads(self.client.get(round_url).content)
+        live_results = self.client.get('/swiss/final_calcs/{0}/'.format(self.tournament.id)).content
+
+        archive = self.tournament.archive()
+
+        self.assertEqual(Matchup.objects.all().count(), 0)
+        self.assertEqual(RoundGroup.objects.all().count(), 0)
+        self.assertEqual(len(archive.get_summary()['rounds']), self.tournament.number_of_rounds)
+        self.assertEqual(json.loads(self.client.get(round_url).content), live_round)
+        self.assertEqual(json.loads(self.client.get('/swiss/final_calcs/{0}/'.format(self.tournament.id)).content), json.loads(live_results))
+        self.assertContains(self.client.get(tournament_round.get_absolute_url()), 'White')
+
+    def test_archived_twice(self):
+        tournament = Tournament.objects.get(id=self.tournament.id)
+        self.assertEqual(tournament.get_archive(), None)
+
+        self.assertTrue(self.tournament.archive())
+        self.assertEqual(tournament.archive(), None)
+        self.assertEqual(TournamentArchive.objects.count(), 1)
+
+    def test_sectioned_archive(self):
+        for number, player in enumerate(Player.objects.order_by('id')):
+            Player.objects.filter(id=player.id).update(elo=2000 + number * 10)
+        tournament = self.play_tournament(Tournament.start_tournament(Player.objects.all(), 1, (2050,)))
+
+        rounds = list(tournament.round_set.order_by('number'))
+        live_matchups = [[matchup.id for matchup in tournament_round.get_matchups()] for tournament_round in rounds]
+        live_round = json.loads(self.client.get('/swiss/api/round/{0}/?format=compact'.format(rounds[-1].id)).content)
+
+        for tournament_round in rounds:
+            groups = [(matchup.round_group.section.number, -matchup.round_group.score_value) for matchup in tournament_round.get_matchups()]
+            self.assertEqual(groups, sorted(groups))
+
+        tournament.archive()
+        tournament = Tournament.objects.get(id=tournament.id)
+
+        self.assertEqual([[matchup.id for matchup in tournament_round.get_matchups()] for tournament_round in tournament.round_set.order_by('number')], live_matchups)
+        self.assertEqual(json.loads(self.client.get('/swiss/api/round/{0}/?format=compact'.format(rounds[-1].id)).content), live_round)
+
+    def test_live_tournament_is_not_archived(self):
+        tournament = Tournament.start_tournament(Player.objects.all(), 1)
+
+        self.assertEqual(tournament.archive(), None)
+        self.assertEqual(len(Tournament.archive_finished()), 1)
+        self.assertTrue(Tournament.objects.get(id=self.tournament.id).get_archive())
+        self.assertEqual(Tournament.archive_finished(), [])
+
+
+class SectionTestCase(TestCase):
+
+    def setUp(self):
+        createplayers(31)
+        for number, player in enumerate(Player.objects.order_by('id')):
+            Player.objects.filter(id=player.id).update(elo=2000 + number * 10)
+
+        # 11 players from 2200, 11 from 2090 and 9 below
+        self.tournament = Tournament.start_tournament(Player.objects.all(), 1, (2200, 2085))
+        self.tournament = Tournament.objects.get(id=self.tournament.id)
+
+    def assertSectionsArePaired(self, tournament_round):
+        for matchup in Matchup.objects.filter(round_group__tournament_round=tournament_round).select_related('round_group', 'black', 'white'):
+            self.assertEqual(matchup.black.section_id, matchup.round_group.section_id)
+            self.assertEqual(matchup.white.section_id, matchup.round_group.section_id)
+
+        byes = tournament_round.get_byes()
+        self.assertEqual([bye.section.number for bye in byes], [1, 2, 3])
+        for bye in byes:
+            self.assertEqual(bye.player.section_id, bye.section_id)
+            self.assertFalse(Matchup.objects.filter(round_group__tournament_round=tournament_round).filter(Q(black=bye.player) | Q(white=bye.player)).exists())
+
+    def test_sections(self):
+        sections = list(self.tournament.section_set.order_by('number'))
+        tournament_round = self.tournament.get_current_round()
+
+        self.assertEqual([section.get_ranked_players().count() for section in sections], [11, 11, 9])
+        self.assertEqual(self.tournament.number_of_rounds, 3)
+        self.assertEqual(Matchup.objects.all().count(), 5 + 5 + 4)
+        self.assertEqual(tournament_round.nonplayer, None)
+        self.assertSectionsArePaired(tournament_round)
+        self.assertContains(self.client.get(self.tournament.get_absolute_url()), 'Section #3 (Elo under 2085.0)')
+        self.assertContains(self.client.get(tournament_round.get_absolute_url()), 'getting score without match', count=3)
+
+        standings = json.loads(self.client.get('/swiss/api/tournament/{0}/standings/?section={1}'.format(self.tournament.id, sections[2].id)).content)
+        self.assertEqual(len(standings['standings']), 9)
+
+        for matchup in tournament_round.get_matchups():
+            matchup.set_result(random.choice(RESULT_SCORES.keys()))
+        tournament_round = self.tournament.start_next_round()
+
+        self.assertEqual(tournament_round.number, 2)
+        self.assertSectionsArePaired(tournament_round)
+        self.assertEqual(Tournament.compute_scores(Tournament.objects.filter(id=self.tournament.id)),
+                         dict(TournamentRank.objects.values_list('id', 'score')))
+
+    def test_parallel_pairing(self):
+        for matchup in self.tournament.get_current_round().get_matchups():
+            matchup.set_result(random.choice(RESULT_SCORES.keys()))
+        sections = self.tournament.get_section_ranks()
+
+        self.assertEqual(len(sections), 3)
+        self.assertEqual(pair_sections(sections, 3), pair_sections(sections))
+
+    def test_single_pool(self):
+        tournament = Tournament.start_tournament(Player.objects.all(), 1)
+
+        self.assertEqual(tournament.section_set.count(), 0)
+        self.assertEqual(tournament.get_section_ranks().keys(), [None])
+        self.assertTrue(tournament.get_current_round().nonplayer)
+        self.assertEqual(len(tournament.get_standings()), 1)
+
+        group = tournament.get_current_round().roundgroup_set.all()[0]
+        with self.assertRaises(IntegrityError):
+            RoundGroup.objects.create(tournament_round=group.tournament_round, score_value=group.score_value)
+
+
+class PlayerStatsTestCase(TestCase):
+
+    def setUp(self):
+        createplayers()
+        self.tournament = Tournament.objects.get(id=Tournament.start_tournament(Player.objects.all(), 1).id)
+
+        User.objects.create_user('judge', password='judge')
+        self.client.login(username='judge', password='judge')
+
+        for number in range(self.tournament.number_of_rounds):
+            if number:
+                self.client.get('/swiss/start_next_round/{0}/'.format(self.tournament.id))
+            for matchup in self.tournament.get_current_round().get_matchups():
+                self.client.get('/swiss/matchup/{0}/{1}/'.format(matchup.id, random.choice(RESULT_SCORES.keys())))
+        self.client.get('/swiss/final_calcs/{0}/'.format(self.tournament.id))
+
+    def get_tables(self):
+        return (
+            sorted(PlayerStats.objects.values_list('player', 'tournaments_played', 'games', 'wins', 'draws', 'losses', 'score', 'opponents_elo_sum')),
+            sorted(PlayerHistory.objects.values_list('player', 'tournament', 'place', 'final_score', 'final_elo', 'games', 'wins', 'losses', 'opponents_elo_sum')),
+            sorted(HeadToHead.objects.values_list('player', 'opponent', 'games', 'wins', 'draws', 'losses', 'score')),
+        )
+
+    def test_statistics(self):
+        games = Matchup.objects.count()
+        self.assertEqual(sum(PlayerStats.objects.values_list('games', flat=True)), games * 2)
+        self.assertEqual(sum(HeadToHead.objects.values_list('games', flat=True)), games * 2)
+        self.assertEqual(PlayerHistory.objects.filter(tournament=self.tournament).count(), Player.objects.count())
+
+        winner = self.tournament.get_ranked_players()[0]
+        self.assertEqual(PlayerHistory.objects.get(player=winner.player_id).place, 1)
+
+        for head_to_head in HeadToHead.objects.all():
+            reverse = HeadToHead.objects.get(player=head_to_head.opponent_id, opponent=head_to_head.player_id)
+            self.assertEqual((head_to_head.wins, head_to_head.draws), (reverse.losses, reverse.draws))
+
+    def test_retried_result_is_counted_once(self):
+        tables = self.get_tables()
+        matchup = Matchup.objects.all()[0]
+
+        self.assertFalse(matchup.set_result('draw'))
+        self.assertEqual(self.get_tables(), tables)
+
+    def test_rebuild(self):
+        tables = self.get_tables()
+
+        PlayerStats.rebuild()
+        self.assertEqual(self.get_tables(), tables)
+
+        Tournament.objects.get(id=self.tournament.id).archive()
+        PlayerStats.rebuild()
+        self.assertEqual(self.get_tables(), tables)
+
+    def test_rows_are_created_on_pairing(self):
+        tournament = Tournament.start_tournament(Player.objects.all(), 1)
+        matchups = list(tournament.get_current_round().get_matchups())
+        rows_count = HeadToHead.objects.count()
+
+        for matchup in matchups:
+            self.assertTrue(HeadToHead.objects.filter(player=matchup.black.player_id, opponent=matchup.white.player_id).exists())
+            self.assertTrue(HeadToHead.objects.filter(player=matchup.white.player_id, opponent=matchup.black.player_id).exists())
+
+        tables = self.get_tables()
+        PlayerStats.rebuild()
+        self.assertEqual(self.get_tables(), tables)
+
+        games = HeadToHead.objects.get(player=matchups[0].black.player_id, opponent=matchups[0].white.player_id).games
+        matchups[0].set_result('draw')
+
+        self.assertEqual(HeadToHead.objects.count(), rows_count)
+        self.assertEqual(HeadToHead.objects.get(player=matchups[0].black.player_id, opponent=matchups[0].white.player_id).games, games + 1)
+
+    def test_create_missing_head_to_head(self):
+        played = HeadToHead.objects.filter(games__gt=0)[0]
+        met = set(HeadToHead.objects.values_list('player', 'opponent'))
+        player_ids = sorted(Player.objects.values_list('id', flat=True))
+        new_pair = [(player_id, opponent_id) for player_id in player_ids for opponent_id in player_ids
+                    if player_id != opponent_id and (player_id, opponent_id) not in met][0]
+        rows_count = HeadToHead.objects.count()
+
+        batch = models.HEAD_TO_HEAD_LOOKUP_BATCH
+        models.HEAD_TO_HEAD_LOOKUP_BATCH = 1
+        try:
+            HeadToHead.create_missing([(played.opponent_id, played.player_id), new_pair])
+        finally:
+            models.HEAD_TO_HEAD_LOOKUP_BATCH = batch
+
+        self.assertEqual(HeadToHead.objects.count(), rows_count + 2)
+        self.assertEqual(HeadToHead.objects.get(id=played.id).games, played.games)
+        self.assertTrue(HeadToHead.objects.filter(player=new_pair[1], opponent=new_pair[0]).exists())
+
+    def test_player_page(self):
+        head_to_head = HeadToHead.objects.order_by('-games')[0]
+
+        self.assertContains(self.client.get('/swiss/player/{0}/'.format(head_to_head.player_id)), 'performance rating')
+
+        response = self.client.get('/swiss/api/player/{0}/head_to_head/{1}/'.format(head_to_head.player_id, head_to_head.opponent_id))
+        self.assertEqual(json.loads(response.content)['games'], head_to_head.games)
+
+        response = self.client.get('/swiss/api/player/{0}/head_to_head/?format=compact&limit=1'.format(head_to_head.player_id))
+        self.assertEqual(len(json.loads(response.content)['rows']), 1)
+
+        winner = self.tournament.get_ranked_players()[0]
+        history = json.loads(self.client.get('/swiss/api/player/{0}/'.format(winner.player_id)).content)['history']
+        self.assertEqual([(row['tournament'], row['place'], row['final_score']) for row in history], [(self.tournament.id, 1, winner.score)])
+
+
+class AdminTestCase(TestCase):
+
+    def setUp(self):
+        createplayers()
+        self.tournament = Tournament.start_tournament(Player.objects.all(), 1)
+
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client = Client()
+        self.client.login(username='admin', password='admin')
+
+        for matchup in self.tournament.get_current_round().get_matchups():
+            self.client.get('/swiss/matchup/{0}/draw/'.format(matchup.id))
+
+    def test_changelists(self):
+        for model in ['matchup', 'lot', 'roundgroup', 'round', 'tournamentrank', 'tournament', 'player']:
+            response = self.client.get('/admin/swiss/{0}/'.format(model))
+            self.assertEqual(response.status_code, 200)
+
+        response = self.client.get('/admin/swiss/matchup/?tournament={0}&round_number=1'.format(self.tournament.id))
+        self.assertEqual(len(response.context['cl'].result_list), 5)
+
+    def test_recompute_scores(self):
+        scores = dict(TournamentRank.objects.values_list('id', 'score'))
+        TournamentRank.objects.update(score=0)
+
+        response = self.client.post('/admin/swiss/tournament/', {
+            'action': 'recompute_scores',
+            '_selected_action': [self.tournament.id],
+        })
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(dict(TournamentRank.objects.values_list('id', 'score')), scores)
+        for ranked_player in TournamentRank.objects.all():
+            self.assertEqual(ranked_player.buchholz_factor, ranked_player.get_buchholz_factor())
+
+
+def explain(queryset):
+    '''
+    query plan of the queryset as (accesses, is_sorted), accesses are (table, number of index columns
+    matched by equality) pairs with None instead of the number for a full table scan,
+    is_sorted means all rows are sorted outside of an index
+    '''
+    sql, params = queryset.query.sql_with_params()
+    cursor = connection.cursor()
+    accesses = []
+    is_sorted = False
+
+    if connection.vendor == 'mysql':
+        cursor.execute('EXPLAIN ' + sql, params)
+        columns = [column[0] for column in cursor.description]
+        for row in cursor.fetchall():
+            row = dict(zip(columns, row))
+            if row['type'] == 'ALL':
+                accesses.append((row['table'], None))
+            else:
+                accesses.append((row['table'], len(row['ref'].split(',')) if row['ref'] else 0))
+            is_sorted = is_sorted or 'Using filesort' in (row['Extra'] or '')
+        return accesses, is_sorted
+
+    cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+    for row in cursor.fetchall():
+        line = row[-1].replace(' TABLE ', ' ')
+        if line.startswith('SCAN') and 'INDEX' not in line:
+            accesses.append((line.split()[1], None))
+        elif line.startswith('SEARCH'):
+            accesses.append((line.split()[1], line.count('=?')))
+        is_sorted = is_sorted or line == 'USE TEMP B-TREE FOR ORDER BY'
+    return accesses, is_sorted
+
+
+class QueryPlanTestCase(TestCase):
+    '''
+    hot queries must stay on indexes: the dataset is big enough and analyzed,
+    so the planner falls back to a full scan as soon as an index is missing
+    '''
+
+    def setUp(self):
+        if connection.vendor not in ('sqlite', 'mysql'):
+            self.skipTest('query plans are checked on sqlite and mysql only')
+
+        createplayers(64)
+        for number in range(20):
+            tournament = Tournament.start_tournament(Player.objects.all(), 1)
+            first_round = Matchup.objects.filter(round_group__tournament_round__tournament=tournament)
+            TournamentRank.objects.filter(white_rank__in=first_round).update(score=SCORE_FOR_WIN)
+            first_round.update(white_score=SCORE_FOR_WIN)
+            tournament.start_next_round()
+
+        self.tournament = Tournament.objects.get(id=tournament.id)
+        self.tournament_round = self.tournament.get_current_round()
+        self.ranked_player = self.tournament.get_ranked_players()[0]
+
+        cursor = connection.cursor()
+        if connection.vendor == 'mysql':
+            cursor.execute('ANALYZE TABLE swiss_matchup, swiss_round, swiss_roundgroup, swiss_tournamentrank, swiss_lot')
+        else:
+            cursor.execute('ANALYZE')
+
+    def assertIndexed(self, queryset, table=None, columns=1, is_sorted=False):
+        accesses, query_is_sorted = explain(queryset)
+        plan = repr(accesses)
+
+        self.assertNotIn(None, [matched for access_table, matched in accesses], plan)
+        if table:
+            self.assertTrue(any(access_table == table and matched >= columns for access_table, matched in accesses), plan)
+        if not is_sorted:
+            self.assertFalse(query_is_sorted, plan)
+
+    def test_round_is_finished(self):
+        matchups = Matchup.objects.filter(round_group__tournament_round=self.tournament_round, black_score=0, white_score=0)
+        self.assertIndexed(matchups, 'swiss_matchup', 3)
+
+    def test_ranked_players(self):
+        # mixed sort directions: score and buchholz come from the index, ties are sorted by rank
+        self.assertIndexed(self.tournament.get_ranked_players(), 'swiss_tournamentrank', is_sorted=connection.vendor == 'mysql')
+
+    def test_score_group(self):
+        self.assertIndexed(self.tournament.tournamentrank_set.filter(score=SCORE_FOR_WIN), 'swiss_tournamentrank', 2)
+
+    def test_current_round(self):
+        self.assertIndexed(Round.objects.filter(tournament=self.tournament).order_by('-number')[:1], 'swiss_round')
+        self.assertIndexed(Round.objects.filter(tournament=self.tournament, number=1), 'swiss_round', 2)
+
+    def test_player_matchups(self):
+        self.assertIndexed(Matchup.objects.filter(Q(black=self.ranked_player) | Q(white=self.ranked_player)), 'swiss_matchup')
+        self.assertIndexed(Matchup.objects.filter(black=self.ranked_player).values('black').annotate(Sum('black_score')), 'swiss_matchup')
+
+    def test_round_matchups(self):
+        self.assertIndexed(self.tournament_round.get_matchups(), 'swiss_matchup', is_sorted=True)
+
+    def test_player_pages(self):
+        player = self.ranked_player.player
+        self.assertIndexed(player.get_history(), 'swiss_playerhistory')
+        self.assertIndexed(player.get_opponents(), 'swiss_headtohead', is_sorted=True)
+        self.assertIndexed(HeadToHead.objects.filter(player=player, opponent=player), 'swiss_headtohead', 2)
+
+        # the lookup of HeadToHead.create_missing: one index probe a pair
+        opponents = Player.objects.exclude(id=player.id)[:2]
+        self.assertIndexed(HeadToHead.objects.filter(reduce(operator.or_, [Q(player=player, opponent=opponent) for opponent in opponents])), 'swiss_headtohead', 2)
+
+
+class RetryTestCase(TestCase):
+
+    def setUp(self):
+        createplayers()
+        self.tournament = Tournament.objects.get(id=Tournament.start_tournament(Player.objects.all(), 1).id)
+
+        User.objects.create_user('judge', password='judge')
+        self.client = Client()
+        self.client.login(username='judge', password='judge')
+
+    def test_retried_result(self):
+        matchup = self.tournament.get_current_round().get_matchups()[0]
+        self.client.get('/swiss/matchup/{0}/white/'.format(matchup.id))
+        response = self.client.get('/swiss/matchup/{0}/black/'.format(matchup.id))
+
+        self.assertEqual(json.loads(response.content)['result'], 'white')
+        self.assertEqual(TournamentRank.objects.get(id=matchup.white_id).score, SCORE_FOR_WIN)
+        self.assertEqual(TournamentRank.objects.get(id=matchup.black_id).score, 0)
+
+    def test_retried_next_round(self):
+        for matchup in self.tournament.get_current_round().get_matchups():
+            self.client.get('/swiss/matchup/{0}/draw/'.format(matchup.id))
+
+        first = self.client.get('/swiss/start_next_round/{0}/'.format(self.tournament.id))
+        second = self.client.get('/swiss/start_next_round/{0}/'.format(self.tournament.id))
+
+        self.assertEqual(first['Location'], second['Location'])
+        self.assertEqual(Round.objects.filter(tournament=self.tournament).count(), 2)
+
+    def test_retried_final_calcs(self):
+        for number in range(self.tournament.number_of_rounds):
+            if number:
+                self.tournament.start_next_round()
+            for matchup in self.tournament.get_current_round().get_matchups():
+                matchup.set_result('black')
+
+        first = json.loads(self.client.get('/swiss/final_calcs/{0}/'.format(self.tournament.id)).content)
+        second = json.loads(self.client.get('/swiss/final_calcs/{0}/'.format(self.tournament.id)).content)
+
+        self.assertEqual(first, second)
+
+    def test_idempotency_key(self):
+        matchup = self.tournament.get_current_round().get_matchups()[0]
+        url = '/swiss/matchup/{0}/draw/'.format(matchup.id)
+
+        first = self.client.get(url, HTTP_X_IDEMPOTENCY_KEY='draw-1')
+        matchup.round_group.tournament_round.tournament.start_next_round()
+        second = self.client.get(url, HTTP_X_IDEMPOTENCY_KEY='draw-1')
+
+        self.assertEqual(first.content, second.content)
+
+    def test_non_ascii_idempotency_key(self):
+        matchup = self.tournament.get_current_round().get_matchups()[0]
+        url = '/swiss/matchup/{0}/draw/'.format(matchup.id)
+
+        first = self.client.get(url, HTTP_X_IDEMPOTENCY_KEY='\xd0\xbd\xd0\xb8\xd1\x87\xd1\x8c\xd1\x8f')
+        second = self.client.get(url, HTTP_X_IDEMPOTENCY_KEY='\xd0\xbd\xd0\xb8\xd1\x87\xd1\x8c\xd1\x8f')
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.content, second.content)
+
+
+class ConcurrencyTestCase(TransactionTestCase):
+    '''
+    many judges work on the same tournament at once, every action must be applied exactly once
+    '''
+
+    JUDGES = 8
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.settings_dict['NAME'] == ':memory:':
+            self.skipTest('in-memory sqlite database is not shared between threads')
+
+        createplayers()
+        self.tournament = Tournament.objects.get(id=Tournament.start_tournament(Player.objects.all(), 1).id)
+        User.objects.create_user('judge', password='judge')
+
+    def run_judges(self, get_urls):
+        responses = []
+        errors = []
+
+        def judge(urls):
+            client = Client()
+            client.login(username='judge', password='judge')
+            try:
+                for url in urls:
+                    response = client.get(url)
+                    if response.status_code not in (200, 302):
+                        errors.append((url, response.status_code))
+                    responses.append(response)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        judges = [threading.Thread(target=judge, args=(get_urls(), )) for number in range(self.JUDGES)]
+        for thread in judges:
+            thread.start()
+        for thread in judges:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        return responses
+
+    def play_current_round(self):
+        matchups = list(self.tournament.get_current_round().get_matchups())
+
+        def get_urls():
+            urls = ['/swiss/matchup/{0}/{1}/'.format(matchup.id, random.choice(RESULT_SCORES.keys())) for matchup in matchups]
+            random.shuffle(urls)
+            return urls
+
+        self.run_judges(get_urls)
+
+    def test_judges(self):
+        for number in range(self.tournament.number_of_rounds):
+            if number:
+                self.run_judges(lambda: ['/swiss/start_next_round/{0}/'.format(self.tournament.id)])
+                self.assertEqual(Round.objects.filter(tournament=self.tournament).count(), number + 1)
+            self.play_current_round()
+
+            self.assertFalse(Matchup.objects.filter(black_score=0, white_score=0).exists())
+            scores = dict(TournamentRank.objects.values_list('id', 'score'))
+            Tournament.recompute_scores(Tournament.objects.all())
+            self.assertEqual(dict(TournamentRank.objects.values_list('id', 'score')), scores)
+
+        responses = self.run_judges(lambda: ['/swiss/final_calcs/{0}/'.format(self.tournament.id)])
+        results = [json.loads(response.content) for response in responses]
+        final_elos = dict((str(rank_id), final_elo) for rank_id, final_elo in TournamentRank.objects.values_list('id', 'final_elo'))
+
+        self.assertEqual(len(results), self.JUDGES)
+        for result in results:
+            self.assertEqual(dict((rank_id, values[0]) for rank_id, values in result.items()), final_elos)
+
+    def test_result_during_recompute(self):
+        '''
+        a judge records a result while recompute_scores has computed the totals but not written them yet
+        '''
+        matchup = Matchup.objects.select_related('round_group__tournament_round').all()[0]
+        compute_scores = Tournament.__dict__['compute_scores']
+        computed, checked = threading.Event(), threading.Event()
+        errors = []
+
+        def compute_and_wait(tournaments):
+            scores = compute_scores.__get__(None, Tournament)(tournaments)
+            computed.set()
+            checked.wait(5)
+            return scores
+
+        def run(method, *args):
+            try:
+                method(*args)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        Tournament.compute_scores = staticmethod(compute_and_wait)
+        try:
+            recompute = threading.Thread(target=run, args=(Tournament.recompute_scores, Tournament.objects.all()))
+            recompute.start()
+            computed.wait(5)
+
+            judge = threading.Thread(target=run, args=(matchup.set_result, 'black'))
+            judge.start()
+            judge.join(1)
+            is_judge_waiting = judge.is_alive()
+            checked.set()
+
+            recompute.join()
+            judge.join()
+        finally:
+            Tournament.compute_scores = compute_scores
+
+        self.assertEqual(errors, [])
+        self.assertTrue(is_judge_waiting)
+        self.assertEqual(Matchup.objects.get(id=matchup.id).get_result(), 'black')
+        self.assertEqual(dict(TournamentRank.objects.values_list('id', 'score')), Tournament.compute_scores(Tournament.objects.all()))
+
+
+class LoadTestTestCase(TransactionTestCase):
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.settings_dict['NAME'] == ':memory:':
+            self.skipTest('in-memory sqlite database is not shared between threads')
+
+    def test_load_test(self):
+        from wg_chess.wsgi import application
+
+        load_test = LoadTest(WsgiTransport(application), tournaments=2, players=8, judges=2, spectators=2)
+        load_test.prepare()
+        load_test.run()
+
+        self.assertEqual(load_test.check_consistency(), [])
+        self.assertEqual(load_test.stats.errors, {})
+        self.assertIn('set_result', load_test.format_report([]))
+
+    def test_percentile(self):
+        values = range(1, 101)
+
+        self.assertEqual([get_percentile(values, percentile) for percentile in (50, 95, 99, 100)], [50, 95, 99, 100])
+        self.assertEqual(get_percentile([7], 99), 7)
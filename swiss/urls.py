@@ -1,16 +1,23 @@
 from django.conf.urls import patterns, include, url
 from django.contrib.auth.decorators import login_required
-from django.contrib import admin
-admin.autodiscover()
 
-from django.views.generic import CreateView, DetailView, ListView
+from django.views.generic import CreateView, ListView
 
 from swiss.models import Player, Tournament, Round
 from swiss.forms import TournamentAddForm
-from swiss.views import TournamentDetailView, TournamentCreateView, RoundDetailView, set_result, start_next_round_view, final_calcs
+from swiss.views import TournamentDetailView, TournamentCreateView, RoundDetailView, PlayerDetailView, set_result, start_next_round_view, final_calcs
+from swiss import api
 
 urlpatterns = patterns('',
-	url(r'player/(?P<pk>\d+)/', DetailView.as_view(model=Player), name="player"),
+    url(r'^api/tournaments/$', api.tournament_list, name="api_tournaments"),
+    url(r'^api/tournament/(?P<pk>\d+)/$', api.tournament_detail, name="api_tournament"),
+    url(r'^api/tournament/(?P<pk>\d+)/standings/$', api.tournament_standings, name="api_standings"),
+    url(r'^api/round/(?P<pk>\d+)/$', api.round_detail, name="api_round"),
+    url(r'^api/player/(?P<pk>\d+)/$', api.player_detail, name="api_player"),
+    url(r'^api/player/(?P<pk>\d+)/head_to_head/$', api.player_opponents, name="api_player_opponents"),
+    url(r'^api/player/(?P<pk>\d+)/head_to_head/(?P<opponent_pk>\d+)/$', api.head_to_head, name="api_head_to_head"),
+
+	url(r'player/(?P<pk>\d+)/', PlayerDetailView.as_view(), name="player"),
 	url(r'players/', ListView.as_view(model=Player), name="players"),
     url(r'new_player/', login_required(CreateView.as_view(model=Player)), name="new_player"),
 
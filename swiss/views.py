@@ -1,12 +1,58 @@
+import hashlib
 import json
 from datetime import datetime
+from functools import wraps
 
+from django.core.cache import cache
 from django.views.generic import CreateView, DetailView
-from django.http import HttpResponseRedirect, HttpResponse
+from django.http import HttpResponseRedirect, HttpResponse, HttpResponseBadRequest
+from django.shortcuts import get_object_or_404
 from django.template.context import RequestContext
 
-from swiss.models import Matchup, Tournament
-from swiss.models import SCORE_FOR_DRAW, SCORE_FOR_WIN
+from swiss.models import Matchup, Player, Tournament
+from swiss.models import RESULT_SCORES
+from swiss.models import get_tournament_cache_version, invalidate_tournament_cache
+
+IDEMPOTENCY_KEY_TIMEOUT = 60 * 60
+IDEMPOTENCY_KEY_PENDING = 'pending'
+
+PLAYER_PAGE_OPPONENTS = 20
+
+
+def idempotent(view):
+    '''
+    a request repeated with the same X-Idempotency-Key header by the same user gets the stored
+    response of the first one; while the first one is still running the repeat gets 409
+    '''
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        # raw header bytes, the path is unicode
+        key = request.META.get('HTTP_X_IDEMPOTENCY_KEY')
+        if not key:
+            return view(request, *args, **kwargs)
+
+        cache_key = 'swiss:idempotency:{0}:{1}'.format(request.user.pk, hashlib.md5(request.path.encode('utf-8') + key).hexdigest())
+        if not cache.add(cache_key, IDEMPOTENCY_KEY_PENDING, IDEMPOTENCY_KEY_TIMEOUT):
+            stored = cache.get(cache_key)
+            if stored is None or stored == IDEMPOTENCY_KEY_PENDING:
+                return HttpResponse(status=409)
+            status_code, content, content_type, location = stored
+            response = HttpResponse(content, content_type=content_type, status=status_code)
+            if location:
+                response['Location'] = location
+            return response
+
+        try:
+            response = view(request, *args, **kwargs)
+        except Exception:
+            cache.delete(cache_key)
+            raise
+
+        stored = (response.status_code, response.content, response['Content-Type'], response.get('Location'))
+        cache.set(cache_key, stored, IDEMPOTENCY_KEY_TIMEOUT)
+        return response
+    return wrapper
+
 
 class TournamentCreateView(CreateView):
 
@@ -18,53 +64,59 @@ class TournamentDetailView(DetailView):
 
     model = Tournament
 
+    def get_context_data(self, **kwargs):
+        context_data = super(TournamentDetailView, self).get_context_data(**kwargs)
+        context_data['cache_version'] = get_tournament_cache_version(self.object.pk)
+        return context_data
+
+
+class PlayerDetailView(DetailView):
+
+    model = Player
+
+    def get_context_data(self, **kwargs):
+        context_data = super(PlayerDetailView, self).get_context_data(**kwargs)
+        context_data['statistics'] = self.object.get_statistics()
+        context_data['history'] = self.object.get_history()
+        context_data['opponents'] = self.object.get_opponents()[:PLAYER_PAGE_OPPONENTS]
+        return context_data
+
 
 class RoundDetailView(DetailView):
     
     def get_context_data(self, **kwargs):
         context_data = super(RoundDetailView, self).get_context_data(**kwargs)
-        round_groups = self.object.roundgroup_set.all()
-        context_data['groups'] = round_groups
+        context_data['groups'] = self.object.get_groups()
         context_data['next_round'] = self.object.get_next_round()
+        context_data['cache_version'] = get_tournament_cache_version(self.object.tournament_id)
         return context_data
 
 
+@idempotent
 def set_result(request, pk, result):
-    matchup = Matchup.objects.get(id=pk)
-
-    if result == 'black':
-        black = matchup.black
-        black.score += SCORE_FOR_WIN
-        black.save()
-        matchup.black_score = SCORE_FOR_WIN
-    elif result == 'white':
-        white = matchup.white
-        white.score += SCORE_FOR_WIN
-        white.save()
-        matchup.white_score = SCORE_FOR_WIN
-    elif result == 'draw':
-        black = matchup.black
-        white = matchup.white
-        black.score += SCORE_FOR_DRAW
-        black.save()
-        white.score += SCORE_FOR_DRAW
-        white.save()
-        matchup.black_score = matchup.white_score = SCORE_FOR_DRAW
-    matchup.save()
+    if result not in RESULT_SCORES:
+        return HttpResponseBadRequest()
 
+    matchup = get_object_or_404(Matchup.objects.select_related('round_group__tournament_round__tournament'), id=pk)
     tournament_round = matchup.round_group.tournament_round
-    can_start_next_round = tournament_round.is_finished() and (tournament_round.number < tournament_round.tournament.number_of_rounds)
-    is_all_games_played = tournament_round.is_finished() and (tournament_round.number == tournament_round.tournament.number_of_rounds)
+
+    if matchup.set_result(result):
+        invalidate_tournament_cache(tournament_round.tournament_id)
+
+    is_round_finished = tournament_round.is_finished()
+    can_start_next_round = is_round_finished and (tournament_round.number < tournament_round.tournament.number_of_rounds)
+    is_all_games_played = is_round_finished and (tournament_round.number == tournament_round.tournament.number_of_rounds)
 
     return HttpResponse(json.dumps(
         {
             'matchup': matchup.id,
-            'result': result,
+            'result': matchup.get_result(),
             'can_start_next_round': can_start_next_round,
             'is_all_games_played': is_all_games_played,
         }
     ))
 
+@idempotent
 def start_next_round_view(request, pk):
     context = RequestContext(request)
     tournament = Tournament.objects.get(id=pk)
@@ -85,6 +137,7 @@ def start_next_round_view(request, pk):
 
     return HttpResponseRedirect(tournament_round.get_absolute_url())
 
+@idempotent
 def final_calcs(request, pk):
     tournament = Tournament.objects.get(id=pk)
     final_results = tournament.finish_tournament()
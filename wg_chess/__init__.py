@@ -0,0 +1,19 @@
+import os
+
+from django.core.exceptions import ImproperlyConfigured
+
+SETTINGS_MODULES = {
+    'dev': 'wg_chess.settings',
+    'production': 'wg_chess.production',
+}
+
+
+def get_settings_module():
+    '''
+    settings profile is chosen by WG_CHESS_PROFILE environment variable, dev by default
+    '''
+    profile = os.environ.get('WG_CHESS_PROFILE', 'dev')
+    if profile not in SETTINGS_MODULES:
+        raise ImproperlyConfigured('Unknown WG_CHESS_PROFILE {0!r}, use one of: {1}'.format(
+            profile, ', '.join(sorted(SETTINGS_MODULES))))
+    return SETTINGS_MODULES[profile]
@@ -0,0 +1,129 @@
+"""
+Compares startup time and per-request overhead of settings profiles.
+
+Every profile is measured in a fresh process, so imports and lazy setup are counted:
+
+    python -m wg_chess.benchmark [--requests N] [settings module ...]
+
+By default the dev and production profiles are compared on the configured database.
+The production profile needs WG_CHESS_SECRET_KEY and WG_CHESS_MEMCACHED in the environment.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import time
+from optparse import OptionParser, SUPPRESS_HELP
+
+from wg_chess import SETTINGS_MODULES
+
+BENCHMARK_PATHS = (
+    '/swiss/players/',
+    '/swiss/tournaments/',
+    '/swiss/api/tournaments/',
+)
+
+
+def measure(requests_count):
+    '''
+    runs in the child process: settings module is already in the environment
+    '''
+    starts_at = time.time()
+    from wg_chess.wsgi import application
+    imported_at = time.time()
+
+    from swiss.loadtest import WsgiTransport
+    from swiss.models import Tournament
+
+    transport = WsgiTransport(application)
+    paths = list(BENCHMARK_PATHS)
+
+    first_request_starts_at = time.time()
+    status, headers, content = transport.request('GET', paths[0])
+    first_request = time.time() - first_request_starts_at
+
+    tournament = Tournament.objects.order_by('-id').first()
+    if tournament:
+        paths.append(tournament.get_absolute_url())
+        current_round = tournament.get_current_round()
+        if current_round:
+            paths.append(current_round.get_absolute_url())
+
+    requests = {}
+    for path in paths:
+        timings = []
+        for number in range(requests_count):
+            request_starts_at = time.time()
+            status, headers, content = transport.request('GET', path)
+            timings.append(time.time() - request_starts_at)
+        timings.sort()
+        requests[path] = {
+            'status': status,
+            'mean': sum(timings) / len(timings),
+            'median': timings[len(timings) / 2],
+        }
+
+    return {
+        'import': imported_at - starts_at,
+        'first_request': first_request,
+        'requests': requests,
+    }
+
+
+def run_profile(settings_module, requests_count):
+    environment = dict(os.environ, DJANGO_SETTINGS_MODULE=settings_module)
+    starts_at = time.time()
+    output = subprocess.check_output(
+        [sys.executable, '-m', 'wg_chess.benchmark', '--child', '--requests', str(requests_count)],
+        env=environment,
+    )
+    result = json.loads(output.splitlines()[-1])
+    result['process'] = time.time() - starts_at
+    return result
+
+
+def format_report(results):
+    profiles = [settings_module for settings_module, result in results]
+    column = max(len(profile) for profile in profiles) + 2
+    header = '{0:<32}'.format('') + ''.join(profile.rjust(column) for profile in profiles)
+
+    def row(title, values):
+        return '{0:<32}'.format(title) + ''.join('{0:.1f} ms'.format(value * 1000).rjust(column) for value in values)
+
+    lines = [
+        header,
+        row('import application', [result['import'] for profile, result in results]),
+        row('first request', [result['first_request'] for profile, result in results]),
+        row('whole process', [result['process'] for profile, result in results]),
+        '',
+        'median per request',
+    ]
+    for path in sorted(results[0][1]['requests']):
+        lines.append(row(path, [result['requests'].get(path, {}).get('median', 0) for profile, result in results]))
+
+    for profile, result in results:
+        for path, timings in sorted(result['requests'].items()):
+            if timings['status'] != 200:
+                lines.append('{0}: {1} responded with {2}'.format(profile, path, timings['status']))
+    return '\n'.join(lines)
+
+
+def main():
+    parser = OptionParser(usage='%prog [options] [settings module ...]')
+    parser.add_option('--requests', dest='requests', type='int', default=50, help='Requests per page')
+    parser.add_option('--child', dest='child', action='store_true', default=False, help=SUPPRESS_HELP)
+    options, settings_modules = parser.parse_args()
+
+    if options.child:
+        result = measure(options.requests)
+        sys.stdout.write('\n' + json.dumps(result) + '\n')
+        return
+
+    settings_modules = settings_modules or [SETTINGS_MODULES['dev'], SETTINGS_MODULES['production']]
+    results = [(settings_module, run_profile(settings_module, options.requests)) for settings_module in settings_modules]
+    print format_report(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,9 @@
 import os
 import sys
 
+# settings.py imports this module before it sets its own BASE_DIR
+BASE_DIR = os.path.dirname(os.path.dirname(__file__))
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.mysql',
@@ -16,5 +19,7 @@ if 'test' in sys.argv:
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+            # a file, not the default in-memory database: the concurrency tests share it between threads
+            'TEST_NAME': os.path.join(BASE_DIR, 'test.sqlite3'),
         }
     }
\ No newline at end of file
@@ -0,0 +1,56 @@
+"""
+Production settings for wg_chess project: the dev settings without the debug toolbar,
+with persistent database connections, cached templates and cached sessions.
+
+Selected with WG_CHESS_PROFILE=production, see wg_chess.get_settings_module
+"""
+
+import os
+
+from django.core.exceptions import ImproperlyConfigured
+
+from wg_chess.settings import *
+
+DEBUG = False
+
+TEMPLATE_DEBUG = False
+
+# the key in settings.py is committed to the repository, it must never sign production sessions
+if not os.environ.get('WG_CHESS_SECRET_KEY'):
+    raise ImproperlyConfigured('Set WG_CHESS_SECRET_KEY for the production profile')
+SECRET_KEY = os.environ['WG_CHESS_SECRET_KEY']
+
+ALLOWED_HOSTS = os.environ.get('WG_CHESS_ALLOWED_HOSTS', 'localhost,127.0.0.1').split(',')
+
+INSTALLED_APPS = tuple(app for app in INSTALLED_APPS if app != 'debug_toolbar')
+
+MIDDLEWARE_CLASSES = tuple(
+    middleware for middleware in MIDDLEWARE_CLASSES if not middleware.startswith('debug_toolbar.')
+)
+
+# keep connections open between requests instead of reconnecting every time
+DATABASES = dict(
+    (alias, dict(database, CONN_MAX_AGE=int(os.environ.get('WG_CHESS_CONN_MAX_AGE', 600))))
+    for alias, database in DATABASES.items()
+)
+
+# templates are read from disk and compiled once per process
+TEMPLATE_LOADERS = (
+    ('django.template.loaders.cached.Loader', (
+        'django.template.loaders.filesystem.Loader',
+        'django.template.loaders.app_directories.Loader',
+    )),
+)
+
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
+# tournament cache versions and idempotent responses have to be shared by all processes serving the site,
+# the default per-process local memory cache would let every worker serve its own stale pages
+if not os.environ.get('WG_CHESS_MEMCACHED'):
+    raise ImproperlyConfigured('Set WG_CHESS_MEMCACHED to the memcached servers for the production profile')
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+        'LOCATION': os.environ['WG_CHESS_MEMCACHED'].split(','),
+    }
+}
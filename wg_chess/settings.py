@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/1.6/ref/settings/
 from local import *
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
+import imp
 import os
 import sys
 
@@ -44,7 +45,6 @@ INSTALLED_APPS = (
     'django.contrib.messages',
     'django.contrib.staticfiles',
 
-    'debug_toolbar',
     # 'south',
     'swiss',
 
@@ -57,10 +57,26 @@ MIDDLEWARE_CLASSES = (
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-
-    'debug_toolbar.middleware.DebugToolbarMiddleware',
 )
 
+
+def is_installed(module_name):
+    '''
+    checks that an optional app is available without importing it
+    '''
+    try:
+        imp.find_module(module_name)
+        return True
+    except ImportError:
+        return False
+
+if is_installed('debug_toolbar'):
+    INSTALLED_APPS += ('debug_toolbar', )
+    MIDDLEWARE_CLASSES += ('debug_toolbar.middleware.DebugToolbarMiddleware', )
+
+# middleware and urls of the toolbar are set up explicitly
+DEBUG_TOOLBAR_PATCH_SETTINGS = False
+
 ROOT_URLCONF = 'wg_chess.urls'
 
 WSGI_APPLICATION = 'wg_chess.wsgi.application'
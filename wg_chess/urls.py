@@ -1,5 +1,5 @@
+from django.conf import settings
 from django.conf.urls import patterns, include, url
-import debug_toolbar
 from django.contrib import admin
 
 from django.views.generic import ListView
@@ -14,8 +14,15 @@ urlpatterns = patterns('',
     url(r'^swiss/', include('swiss.urls')),
 
     url(r'^admin/', include(admin.site.urls)),
-    url(r'^__debug__/', include(debug_toolbar.urls)),
+)
+
+if 'debug_toolbar' in settings.INSTALLED_APPS:
+    import debug_toolbar
+    urlpatterns += patterns('',
+        url(r'^__debug__/', include(debug_toolbar.urls)),
+    )
 
+urlpatterns += patterns('',
     url(r'$', ListView.as_view(model=Player)),
 	url(r'/$', ListView.as_view(model=Player)),
 )
@@ -8,7 +8,9 @@ https://docs.djangoproject.com/en/1.6/howto/deployment/wsgi/
 """
 
 import os
-os.environ.setdefault("DJANGO_SETTINGS_MODULE", "wg_chess.settings")
+
+from wg_chess import get_settings_module
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", get_settings_module())
 
 from django.core.wsgi import get_wsgi_application
 application = get_wsgi_application()